@@ -1,9 +1,26 @@
+import json
 import random
+import re
 import streamlit as st
-from const import SESS
+import time
+from analysis import analysis_key, chart_analysis
+from cache import DiskCache, LRUCache
+from const import (
+    AI_ANSWER_CACHE_BYTES,
+    AI_ANSWER_CACHE_DIR,
+    AI_ANSWER_CACHE_TTL,
+    AI_HISTORY_TOKENS,
+    AI_POLL_INTERVAL,
+    AI_PREWARM,
+    AI_PROMPT_CACHE_SIZE,
+    SESS,
+)
 from dataclasses import dataclass, field
-from natal import AIContext, Data
-from openai import OpenAI
+from hashlib import sha256
+from llm import Reply, compact_history, is_fatal, race, shared_client, stream, submit
+from natal import Data
+from natal.data import DotDict
+from openai import AsyncOpenAI
 from typing import Literal, TypedDict
 from utils import i, lang_num, scroll_to_bottom
 
@@ -15,6 +32,10 @@ MODELS = [
     "meta-llama/llama-3.3-70b-instruct:free",
     "stepfun/step-3.5-flash:free",
 ]
+# asked in this order after the selected model, until one answers
+FALLBACK_MODELS = MODELS
+FIRST_TOKEN_TIMEOUT = 30  # seconds a model may stay silent before it is replaced by the next one
+HEDGE_AFTER = 5  # seconds of silence before the next model is raced against it, None to only fail over
 
 SYS_PROMPT = """\
 You are an expert astrologer. You answer questions about this astrological chart based on the chart_data provided.
@@ -486,114 +507,205 @@ class Message(TypedDict):
     content: str
 
 
+@st.cache_resource
+def answer_cache() -> DiskCache:
+    return DiskCache("ai_answers", AI_ANSWER_CACHE_DIR, max_bytes=AI_ANSWER_CACHE_BYTES, ttl=AI_ANSWER_CACHE_TTL)
+
+
+def normalize(question: str) -> str:
+    """question ideas match however they are cased, spaced or punctuated"""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.casefold()).split())
+
+
+def answer_key(sys_prompt: str, question: str, model: str, lang: int) -> str:
+    """answers depend on the chart context in the system prompt, the question, the model and the language"""
+    return json.dumps([sha256(sys_prompt.encode()).hexdigest(), normalize(question), model, lang])
+
+
+async def prewarm(
+    client: AsyncOpenAI, sys_prompt: str, questions: list[str], models: list[str], lang: int, cache: DiskCache
+) -> None:
+    """answer question ideas into the answer cache, one at a time
+
+    answers are saved under the model that answered, so a question answered by any of `models` is skipped
+    """
+    for question in questions:
+        if any(cache.get(answer_key(sys_prompt, question, model, lang)) is not None for model in models):
+            continue
+        messages = [Message(role="developer", content=sys_prompt), Message(role="user", content=question)]
+        answer, model = "", None
+        try:
+            async for model, content in race(client, models, messages, FIRST_TOKEN_TIMEOUT, HEDGE_AFTER):
+                answer += content
+        except Exception:  # busy or invalid key, the questions are asked when clicked
+            return
+        if answer:
+            cache.set(answer_key(sys_prompt, question, model, lang), answer.encode())
+
+
 class OpenRouterChat:
-    def __init__(self, system_message: str):
-        self.client = OpenAI(base_url=AI_BASE_URL, api_key=SESS.openrouter_api_key)
+    def __init__(self, system_message: str, lang: int):
+        self.client = shared_client(AI_BASE_URL, SESS.openrouter_api_key)
         self.messages = [Message(role="developer", content=system_message)]
+        self.model = None
+        self.lang = lang
+        self.reply: Reply | None = None
+        self.save = False
+        self.tried: list[str] = []  # models raced for the last question
 
     def is_retryable_error(self, error: Exception) -> bool:
         """Check if error is retryable (network, temporary issues)"""
         error_codes = ["429", "500", "502", "503", "504"]
         return any(str(error).lower().startswith(f"error code: {code}") for code in error_codes)
 
-    def send_message_stream(self, prompt: str):
-        """Send message with failover support and return streaming response"""
+    def models(self) -> list[str]:
+        """selected model first, then the fallbacks"""
+        return [SESS.ai_model, *(model for model in FALLBACK_MODELS if model != SESS.ai_model)]
+
+    def answer_key(self, question: str, model: str) -> str:
+        return answer_key(self.messages[0]["content"], question, model, self.lang)
+
+    def cached_answer(self, question: str) -> tuple[str, bytes] | None:
+        """model and answer of the first model with a cached answer, in the order prewarm races them"""
+        for model in self.models():
+            if (answer := answer_cache().get(self.answer_key(question, model))) is not None:
+                return model, answer
+        return None
+
+    def ask(self, prompt: str, cached: bool = False) -> None:
+        """start answering in the background, into `self.reply`
+
+        `cached` answers are read from the answer cache, and saved to it when asked first in the chat
+        """
+        self.save = cached and len(self.messages) == 1
         self.messages.append(Message(role="user", content=prompt))
+        self.model = None
 
-        try:
-            # st.write(f"using model: {self.model}")
-            response = self.client.chat.completions.create(
-                model=SESS.ai_model,
-                messages=self.messages,
-                stream=True,
-            )
-
-            full_response = ""
-            for chunk in response:
-                if content := chunk.choices[0].delta.content:
-                    full_response += content
-                    yield content
-
-            self.messages.append(Message(role="assistant", content=full_response))
+        if cached and (hit := self.cached_answer(prompt)) is not None:
+            model, answer = hit
+            self.reply = Reply(text=answer.decode(), model=model, done=True)
+            self.save = False
             return
 
-        except Exception as e:
-            if self.is_retryable_error(e):
-                st.warning(f"{SESS.ai_model} {i('model_busy')}")
+        messages = compact_history(self.messages, AI_HISTORY_TOKENS)
+        self.tried = self.models()
+        self.reply = stream(race(self.client, self.tried, messages, FIRST_TOKEN_TIMEOUT, HEDGE_AFTER))
+
+    def finish(self) -> None:
+        """add the completed reply to the messages, or toast its error. called in the script run, not a callback"""
+        reply, self.reply = self.reply, None
+        if reply.error is None:
+            self.model = reply.model
+            self.messages.append(Message(role="assistant", content=reply.text))
+            if self.save and reply.text:
+                # answered without earlier turns, so it fits any chat about this chart
+                answer_cache().set(self.answer_key(self.messages[-2]["content"], reply.model), reply.text.encode())
+        else:
+            if self.is_retryable_error(reply.error):
+                st.toast(i("models_busy"), icon="⚠️")
             else:
-                st.error(f"{SESS.ai_model} {i('model_unavailable')}")
+                # race asks every model before giving up, unless the key or credits are the problem
+                tried = self.tried[:1] if is_fatal(reply.error) else self.tried
+                st.toast(i("models_unavailable").format(models=", ".join(tried)), icon=":material/error:")
             del self.messages[-1]
 
+    def cancel(self) -> None:
+        """stop the reply of a chat that is discarded"""
+        if self.reply:
+            self.reply.cancel()
 
-@dataclass
-class AI:
-    data1: Data
-    data2: Data | None
-    city1: str | None = field(init=False)
-    city2: str | None = field(init=False)
-    tz1: str | None = field(init=False)
-    tz2: str | None = field(init=False)
-    chat: OpenRouterChat = field(init=False)
-    suffled_questions: list[list[str]] = field(init=False)
-    sys_prompt: str = field(init=False)
-    chart_type: str = field(init=False)
 
-    def __post_init__(self) -> None:
-        chart_type = SESS.chart_type
-        ai = AIContext(
-            data1=self.data1,
-            data2=self.data2,
-            city1=SESS.city1,
-            city2=SESS.city2,
-            tz1=SESS.tz1,
-            tz2=SESS.tz2,
-        )
-        name1 = self.data1.name
+def table(title: str, grid: list[list]) -> str:
+    """chart data table in the system prompt, pipe separated rows without the padding and divider of markdown"""
+    rows = "\n".join("|".join(str(cell) for cell in row) for row in grid)
+    return f"#### {title}\n{rows}\n"
+
+
+@st.cache_resource
+def prompt_cache() -> LRUCache:
+    return LRUCache("ai_prompt", max_entries=AI_PROMPT_CACHE_SIZE)
+
+
+def sys_prompt(data1: Data, data2: Data | None, lang: int, sess: DotDict = SESS) -> str:
+    """system prompt with the chart data, rendered once per chart, chart type and language"""
+    chart_type = sess.chart_type
+
+    def build() -> str:
+        ai = chart_analysis(data1, data2, sess)
+        name1 = data1.name
         name1_cel_bodies = name1 + " celestial bodies"
-        data = [ai.markdown("User's Basic Info", ai.basic_info())]
-        if self.data2:
-            name2 = self.data2.name
+        data = [table("User's Basic Info", list(zip(*ai.basic_info())))]
+        if data2:
+            name2 = data2.name
             name2_cel_bodies = f"{name2} celestial bodies in {name1}'s chart"
             cel_headers = ["Celestial Body", "Sign", f"{name1}'s House", "Dignity"]
             signs_headers = ["Sign", name1_cel_bodies, name2_cel_bodies, "sum"]
             houses_headers = ["House", "Cusp", name1_cel_bodies, name2_cel_bodies, "sum"]
             data += [
-                ai.markdown(name1_cel_bodies, ai.celestial_bodies(1, cel_headers)),
-                ai.markdown(name2_cel_bodies, ai.celestial_bodies(2, cel_headers)),
-                ai.markdown("Signs", ai.signs(headers=signs_headers)),
-                ai.markdown("Houses", ai.houses(headers=houses_headers)),
-                ai.markdown(f"Aspects between {name1} and {name2}", ai.aspects()),
+                table(name1_cel_bodies, ai.celestial_bodies(1, cel_headers)),
+                table(name2_cel_bodies, ai.celestial_bodies(2, cel_headers)),
+                table("Signs", ai.signs(headers=signs_headers)),
+                table("Houses", ai.houses(headers=houses_headers)),
+                table(f"Aspects between {name1} and {name2}", ai.aspects()),
             ]
         else:
             data += [
-                ai.markdown("Celestial Bodies", ai.celestial_bodies(1)),
-                ai.markdown("Signs", ai.signs()),
-                ai.markdown("Houses", ai.houses()),
-                ai.markdown("Aspects", ai.aspects()),
+                table("Celestial Bodies", ai.celestial_bodies(1)),
+                table("Signs", ai.signs()),
+                table("Houses", ai.houses()),
+                table("Aspects", ai.aspects()),
             ]
         data += [
-            ai.markdown(f"{name1} Elements", ai.elements()),
-            ai.markdown(f"{name1} Modalities", ai.modalities()),
-            ai.markdown(f"{name1} Polarities", ai.polarities()),
-            ai.markdown(f"{name1} Quadrants", ai.quadrants()),
+            table(f"{name1} Elements", ai.elements()),
+            table(f"{name1} Modalities", ai.modalities()),
+            table(f"{name1} Polarities", ai.polarities()),
+            table(f"{name1} Quadrants", ai.quadrants()),
         ]
-
-        lang = ["English", "Traditional Chinese"][lang_num()]
-        chart_type_en = chart_type.replace("_page", "").replace("_", " ").title()
-        self.sys_prompt = SYS_PROMPT.format(
-            chart_type_en=chart_type_en,
-            lang=lang,
+        return SYS_PROMPT.format(
+            chart_type_en=chart_type.replace("_page", "").replace("_", " ").title(),
+            lang=["English", "Traditional Chinese"][lang],
             chart_data="\n".join(data),
         )
+
+    key = (analysis_key(data1, data2, sess), chart_type, lang)
+    return prompt_cache().get_or_set(key, build)
+
+
+@dataclass
+class AI:
+    data1: Data
+    data2: Data | None
+    city1: str | None = field(init=False)
+    city2: str | None = field(init=False)
+    tz1: str | None = field(init=False)
+    tz2: str | None = field(init=False)
+    chat: OpenRouterChat = field(init=False)
+    suffled_questions: list[list[str]] = field(init=False)
+    sys_prompt: str = field(init=False)
+    chart_type: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        chart_type = self.chart_type = SESS.chart_type
+        lang = lang_num()
+        self.sys_prompt = sys_prompt(self.data1, self.data2, lang)
         self.suffled_questions = AI_Q[chart_type]
         random.shuffle(self.suffled_questions)
         # debug
         # st.code(self.sys_prompt, language="markdown")
-        self.chat = OpenRouterChat(self.sys_prompt)
+        self.chat = OpenRouterChat(self.sys_prompt, lang)
+        if AI_PREWARM and (SESS.get("openrouter_api_key") or "").strip():
+            # the ideas shown first, answered with the key of this user
+            questions = [question[lang] for question in self.suffled_questions[:AI_PREWARM]]
+            submit(prewarm(self.chat.client, self.sys_prompt, questions, self.chat.models(), lang, answer_cache()))
 
     def renew_chat(self) -> None:
         """Recreate chat so it uses the current OpenRouter API key."""
-        self.chat = OpenRouterChat(self.sys_prompt)
+        self.chat.cancel()
+        self.chat = OpenRouterChat(self.sys_prompt, self.chat.lang)
+
+    def is_idea(self, question: str) -> bool:
+        """one of the question ideas, also when typed in by hand"""
+        return normalize(question) in {normalize(idea) for ideas in AI_Q[self.chart_type] for idea in ideas}
 
     def questions_ideas(self):
         with st.expander(i("question_ideas"), expanded=True):
@@ -607,6 +719,7 @@ class AI:
                         icon=":material/arrow_right:",
                         on_click=SESS.update,
                         args=({"chat_input": question},),
+                        disabled=self.chat.reply is not None,
                     )
 
     def model_selector(self):
@@ -625,38 +738,45 @@ class AI:
             text = message["content"]
             with st.chat_message(role, avatar="👤" if role == "user" else "💫"):
                 st.markdown(text)
+        if self.chat.messages[-1]["role"] == "assistant" and self.chat.model not in (None, SESS.ai_model):
+            st.caption(i("answered_by").format(model=self.chat.model))
 
     def handle_user_input(self):
         if not (SESS.get("openrouter_api_key") or "").strip():
             st.toast(i("openrouter_api_key_required"), icon="⚠️", duration="long")
             return
-        # Display user message
-        prompt = SESS.chat_input
-        # wrap in container for putting in st.empty()
-        msg = st.container(key="ai_messages")
-        with msg.chat_message("user", avatar="👤"):
-            st.markdown(prompt)
-
-        # Generate and display assistant response
-        with msg.chat_message("assistant", avatar="💫"):
-            try:
-                response = self.chat.send_message_stream(prompt)
-                with st.spinner(f"{i('thinking')}...", show_time=True):
-                    scroll_to_bottom(key="start_response")
-                    st.write_stream(chunk for chunk in response)
-                    scroll_to_bottom(key="finish_response")
-            except Exception as e:
-                st.error(e)
+        if self.chat.reply is None:
+            prompt = SESS.chat_input
+            self.chat.ask(prompt, cached=self.is_idea(prompt))
+
+    def reply_ui(self):
+        """answer of the chat, rendered from its buffer until it is complete"""
+
+        def poll():
+            if (reply := self.chat.reply) is None or reply.done:
+                # the script run adds it to the previous messages
+                st.rerun()
+            with st.chat_message("assistant", avatar="💫"):
+                if reply.text:
+                    st.markdown(reply.text)
+                else:
+                    st.markdown(f"{i('thinking')}... ({time.monotonic() - reply.started:.0f}s)")
+
+        scroll_to_bottom(key="start_response")
+        st.fragment(poll, run_every=AI_POLL_INTERVAL)()
 
     def ui(self):
+        # answered in the background, so the answer survives reruns and no script thread waits for the model
+        if SESS.get("chat_input"):
+            self.handle_user_input()
+        if (reply := self.chat.reply) and reply.done:
+            # answered from the cache, or completed since the last poll
+            self.chat.finish()
         self.model_selector()
         self.questions_ideas()
         self.previous_chat_messages()
+        if self.chat.reply:
+            self.reply_ui()
         # wrap st.chat_input in st.container to avoid unnecessary reruns, which resets the user input
         with st.container(key="chat_container"):
-            response_holder = st.empty()
-            prompt = st.chat_input(i("chat_placeholder"), key="chat_input")
-            if prompt:
-                with response_holder:
-                    ai: AI = SESS.ai
-                    ai.handle_user_input()
+            st.chat_input(i("chat_placeholder"), key="chat_input", disabled=self.chat.reply is not None)
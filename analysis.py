@@ -0,0 +1,102 @@
+"""chart statistics computed once per chart and shared by the stats panel, PDF report and AI context"""
+
+import streamlit as st
+from cache import LRUCache
+from const import ANALYSIS_CACHE_SIZE, SESS
+from dataclasses import dataclass, field
+from ephemeris import key_of
+from functools import wraps
+from natal import Data, Stats
+from natal.ai import AIContext
+from natal.data import DotDict
+from typing import Any, Callable
+
+
+def freeze(value: Any) -> Any:
+    """hashable form of method arguments, label lists become tuples"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+def memo(method: Callable[..., list]) -> Callable[..., list]:
+    """grid computed once per set of arguments
+
+    callers get a fresh copy of the rows, since `AIContext.markdown` pops the header of the grid it is given
+    """
+
+    @wraps(method)
+    def wrapper(self: "ChartAnalysis", *args, **kwargs) -> list:
+        key = (method.__name__, freeze(args), freeze(kwargs))
+        if (grid := self._memo.get(key)) is None:
+            # concurrent sessions may both build it, either result is the same
+            grid = self._memo[key] = method(self, *args, **kwargs)
+        return [list(row) for row in grid]
+
+    return wrapper
+
+
+@dataclass
+class ChartAnalysis(AIContext):
+    """natal.Stats and natal.AIContext grids of a chart, each memoized per set of labels
+
+    `basic_info` is the Stats grid, the AI context pivots it with `zip(*grid)`
+    """
+
+    _memo: dict = field(default_factory=dict, init=False, repr=False)
+
+    def aspect_pairs(self):
+        """synastry aspects are calculated on every call, keep them for aspect_grid and aspects"""
+        if (pairs := self._memo.get("aspect_pairs")) is None:
+            pairs = self._memo["aspect_pairs"] = super().aspect_pairs()
+        return pairs
+
+    @memo
+    def basic_info(self, headers: list[str] | None = None):
+        if headers is None:
+            headers = ["name", "city", "coordinates", "local time"]
+        return Stats.basic_info(self, headers)
+
+    elements_vs_modalities = memo(Stats.elements_vs_modalities)
+    quadrants_vs_hemispheres = memo(Stats.quadrants_vs_hemispheres)
+    celestial_bodies = memo(Stats.celestial_bodies)
+    signs = memo(Stats.signs)
+    houses = memo(Stats.houses)
+    aspect_grid = memo(Stats.aspect_grid)
+    orb_settings = memo(Stats.orb_settings)
+    aspects = memo(AIContext.aspects)
+    distribution = memo(AIContext.distribution)
+    quadrants = memo(AIContext.quadrants)
+    hemispheres = memo(AIContext.hemispheres)
+
+
+@st.cache_resource
+def analysis_cache() -> LRUCache:
+    return LRUCache("chart_analysis", max_entries=ANALYSIS_CACHE_SIZE)
+
+
+def analysis_key(data1: Data, data2: Data | None = None, sess: DotDict = SESS) -> tuple:
+    """the data a chart analysis is computed from, and the names and places it shows"""
+    key = (data1.name, key_of(data1), sess.city1, sess.tz1)
+    if data2:
+        key += (data2.name, key_of(data2), sess.city2, sess.tz2)
+    return key
+
+
+def chart_analysis(data1: Data, data2: Data | None = None, sess: DotDict = SESS) -> ChartAnalysis:
+    """shared analysis of a chart"""
+    key = analysis_key(data1, data2, sess)
+
+    def build() -> ChartAnalysis:
+        return ChartAnalysis(
+            data1=data1,
+            data2=data2,
+            city1=sess.city1,
+            city2=sess.city2 if data2 else None,
+            tz1=sess.tz1,
+            tz2=sess.tz2 if data2 else None,
+        )
+
+    return analysis_cache().get_or_set(key, build)
@@ -1,14 +1,38 @@
 import json
 import streamlit as st
-from const import GENERAL_OPTS, SESS
+import threading
+from collections import deque
+from concurrent.futures import Future
+from const import EXPORT_CHUNK, EXPORT_WINDOW, GENERAL_OPTS, SESS
 from datetime import datetime
 from hashlib import md5
+from itertools import count
 from natal.config import Dictable, Display
 from natal.const import ASPECT_NAMES
 from natal.data import DotDict
 from pydantic import ValidationError, create_model
-from typing import Iterable, Literal
-from utils import data_db, get_dt
+from streamlit.logger import get_logger
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from typing import BinaryIO, Callable, Iterable, Iterator, Literal
+from utils import (
+    PDF_VERSION,
+    charts_count,
+    charts_filter,
+    data_db,
+    get_dt,
+    is_form_valid,
+    lang_num,
+    natal_data,
+    pdf_cache,
+    pdf_filename,
+    pdf_html,
+    pdf_queue,
+    settings_cache,
+    touch_charts,
+)
+from zipfile import ZIP_STORED, ZipFile
+
+logger = get_logger(__name__)
 
 DataArchive = create_model(
     "DataArchive",
@@ -30,7 +54,7 @@ def archive_str(sess: DotDict = SESS) -> str:
 
     try:
         data = {f"{prop}{i}": sess[f"{prop}{i}"] for prop in ["name", "city", "lat", "lon", "tz"] for i in "12"}
-        data |= {f"dt{i}": get_dt(i) for i in [1, 2]}
+        data |= {f"dt{i}": get_dt(i, sess) for i in [1, 2]}
         data |= {asp: sess[asp] for asp in ASPECT_NAMES}
         data |= {f"{body}{i}": sess[f"{body}{i}"] for body in Display.model_fields for i in "12"}
         data |= {"solar_return_year": sess["solar_return_year"]}
@@ -41,11 +65,25 @@ def archive_str(sess: DotDict = SESS) -> str:
     return model.model_dump_json()
 
 
-def data_hash(sess: DotDict = SESS) -> str:
-    """hash the data to avoid inserting duplicate charts"""
+def raw_chart_data(sess: DotDict = SESS) -> list:
+    """chart inputs that identify a saved chart"""
     raw_data = [sess[f"{prop}{i}"] for prop in ["name", "city", "lat", "lon", "tz", "hr", "min"] for i in "12"]
     raw_data += [sess[f"date{i}"].strftime("%Y-%m-%d") if sess[f"date{i}"] else None for i in "12"]
     raw_data += [sess["chart_type"], sess["solar_return_year"]]
+    return raw_data
+
+
+def data_hash(sess: DotDict = SESS) -> str:
+    """hash the data to avoid inserting duplicate charts"""
+    return md5(json.dumps(raw_chart_data(sess)).encode()).hexdigest()
+
+
+def chart_hash(*extra, sess: DotDict = SESS) -> str:
+    """hash of the chart data plus the options a rendered chart depends on, eg. theme or width in `extra`"""
+    raw_data = raw_chart_data(sess) + [sess["house_sys"]]
+    raw_data += [sess[asp] for asp in ASPECT_NAMES]
+    raw_data += [sess[f"{body}{i}"] for body in Display.model_fields for i in "12"]
+    raw_data += list(extra)
     return md5(json.dumps(raw_data).encode()).hexdigest()
 
 
@@ -75,55 +113,155 @@ def load_chart(data: dict, sess: DotDict = SESS):
 
 def save_chart(email: str) -> Literal["overwrite", "create"]:
     """Save a chart to the database. overwrite or create depending if hash exists"""
-    hash = data_hash()
-    cursor = data_db().cursor()
-    data = archive_str()
-    values = [data, hash, SESS.chart_type]
-    # print(data)
-    if hash_exists(email, hash):
-        sql = "UPDATE charts SET data = ? WHERE hash = ? and chart_type = ?"
-        output = "overwrite"
-    else:
-        sql = "INSERT INTO charts (data, hash, chart_type, email) VALUES (?, ?, ?, ?)"
-        values.append(email)
-        output = "create"
-    cursor.execute(sql, values)
-    data_db().commit()
-    return output
+    sql = """INSERT INTO charts (data, hash, chart_type, email) VALUES (?, ?, ?, ?)
+        ON CONFLICT (email, hash) DO UPDATE SET data = excluded.data, revision = revision + 1
+        RETURNING revision"""
+    values = (archive_str(), data_hash(), SESS.chart_type, email)
+    [(revision,)] = data_db().transact(lambda conn: conn.execute(sql, values).fetchall())
+    touch_charts(email)
+    return "create" if revision == 1 else "overwrite"
 
 
 def delete_chart(email: str, chart_hash: str) -> None:
     """Delete a chart by its hash."""
     sql = "DELETE FROM charts WHERE hash = ? AND email = ?"
-    cursor = data_db().cursor()
-    cursor.execute(sql, (chart_hash, email))
-    data_db().commit()
+    data_db().execute(sql, (chart_hash, email))
+    touch_charts(email)
 
 
 def create_user(options: Iterable) -> None:
-    cursor = data_db().cursor()
-    cursor.execute(
+    data_db().execute(
         f"""INSERT INTO users 
         (email, {", ".join(GENERAL_OPTS)}) 
         VALUES (?, {", ".join(["?"] * len(GENERAL_OPTS))});""",
-        options,
+        list(options),
     )
-    data_db().commit()
-
-
-def hash_exists(email: str, hash: str) -> bool:
-    """Check if a chart with the same hash and email exists"""
-    sql = "SELECT 1 FROM charts WHERE email = ? AND hash = ?"
-    cursor = data_db().cursor()
-    cursor.execute(sql, (email, hash))
-    return cursor.fetchone() is not None
 
 
 def fetch_user_record(email: str) -> dict | None:
     sql = f"SELECT {', '.join(GENERAL_OPTS)} FROM users WHERE email = ?"
-    cursor = data_db().cursor()
-    cursor.execute(sql, (email,))
-    saved_vals = cursor.fetchone()
+    saved_vals = data_db().fetchone(sql, (email,))
     if saved_vals is None:
         return None
     return dict(zip(GENERAL_OPTS, saved_vals))
+
+
+# batch export =================================================================
+
+
+def export_pdfs(
+    email: str,
+    chart_type: str,
+    query: str,
+    target: BinaryIO,
+    progress: Callable[[int, int], None],
+) -> int:
+    """write PDF reports of the saved charts matching the query into a ZIP, return the number exported
+
+    charts are read EXPORT_CHUNK at a time and rendered in parallel on the PDF workers, at most EXPORT_WINDOW
+    in flight. each PDF is written to the ZIP as soon as its turn comes, so memory doesn't grow with the export.
+    reports are shared with the print button through the PDF cache
+    """
+    where, params = charts_filter(email, chart_type, query)
+    total = charts_count(email, chart_type, query)
+    lang, house_sys, pdf_color = lang_num(), SESS.house_sys, SESS.pdf_color
+    # filename and cache key of each report, the key is None if read from the cache
+    reports_info = deque()
+
+    def reports() -> Iterator[str | bytes]:
+        sql = f"SELECT data FROM charts WHERE {where} ORDER BY updated_at DESC LIMIT ? OFFSET ?"
+        for offset in range(0, total, EXPORT_CHUNK):
+            for (data,) in data_db().fetchall(sql, params + [EXPORT_CHUNK, offset]):
+                # the saved chart with the current house system and colors, like loading it and printing
+                sess = DotDict(chart_type=chart_type, house_sys=house_sys, pdf_color=pdf_color)
+                load_chart(json.loads(data), sess)
+                if not is_form_valid(1, sess):
+                    continue
+                # the key of pdf_ui
+                key = chart_hash("pdf", sess.pdf_color, lang, *PDF_VERSION, sess=sess)
+                if (pdf := pdf_cache().get(key)) is not None:
+                    reports_info.append((pdf_filename(sess), None))
+                    yield pdf
+                    continue
+                data2 = natal_data(2, sess) if chart_type in ["synastry_page", "transit_page"] else None
+                reports_info.append((pdf_filename(sess), key))
+                yield pdf_html(natal_data(1, sess), data2, sess)
+
+    exported = 0
+    with ZipFile(target, "w", ZIP_STORED) as zf:  # PDFs are compressed already
+        for n, future in enumerate(pdf_queue().render_many(reports(), EXPORT_WINDOW), 1):
+            filename, key = reports_info.popleft()
+            try:
+                pdf = future.result()
+                zf.writestr(f"{n:03d}_{filename}.pdf", pdf)
+                exported += 1
+                if key is not None:
+                    pdf_cache().set(key, pdf)
+            except Exception as e:  # any job error fails the report, as in PdfQueue.status
+                logger.error("exporting %s failed: %r", filename, e)
+            progress(n, total)
+    return exported
+
+
+def submit_export(
+    email: str,
+    chart_type: str,
+    query: str,
+    target: BinaryIO,
+    progress: Callable[[int, int], None],
+) -> Future:
+    """run export_pdfs in a background thread, so reruns of the script don't stop it. resolves to the number exported
+
+    the thread shares the session's script context: pdf_html reads the language and session options through it
+    """
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(export_pdfs(email, chart_type, query, target, progress))
+            except Exception as e:
+                logger.error("export failed: %r", e)
+                future.set_exception(e)
+
+    thread = threading.Thread(target=run, name="export", daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+    return future
+
+
+# user settings ================================================================
+
+# versions are unique across the process, so a tab can tell its settings are stale with one comparison
+_versions = count(1)
+# held by updates and reloads, so a reload after eviction sees every update queued before it
+_settings_lock = threading.RLock()
+
+
+def user_settings(email: str) -> tuple[int, dict]:
+    """version and general options of a user, read from the database once per process"""
+
+    def load() -> tuple[int, dict]:
+        data_db().flush()  # updates of the evicted entry may still be queued
+        if (record := fetch_user_record(email)) is None:
+            # new user, saved with default options
+            record = {field: SESS[field] for field in GENERAL_OPTS}
+            create_user([email, *record.values()])
+        return next(_versions), record
+
+    if (settings := settings_cache().get(email)) is not None:
+        return settings
+    with _settings_lock:
+        return settings_cache().get_or_set(email, load)
+
+
+def update_setting(email: str, key: str, value) -> int:
+    """write-through: update the cached settings now and the database in the background. returns the new version"""
+    sql = f"UPDATE users SET {key} = ? WHERE email = ?"
+    with _settings_lock:
+        _, settings = user_settings(email)
+        version = next(_versions)
+        settings_cache().set(email, (version, settings | {key: value}))
+        future = data_db().submit(lambda conn: conn.execute(sql, (value, email)))
+    future.add_done_callback(lambda f: f.exception() and logger.error("saving %s failed: %s", key, f.exception()))
+    return version
@@ -0,0 +1,201 @@
+"""process-wide caches shared by all sessions"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from typing import Any, Callable, Hashable
+
+_registry: dict[str, "LRUCache | DiskCache"] = {}
+
+
+class LRUCache:
+    """thread-safe LRU cache with optional TTL and hit / miss / eviction counters"""
+
+    def __init__(self, name: str, max_entries: int = 128, ttl: float | None = None) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: dict[Hashable, threading.Lock] = {}
+        _registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._live(key)
+
+    def _live(self, key: Hashable) -> bool:
+        """check key existence, drop it if expired. caller must hold the lock"""
+        if key not in self._items:
+            return False
+        created, _ = self._items[key]
+        if self.ttl is not None and time.monotonic() - created > self.ttl:
+            del self._items[key]
+            self.evictions += 1
+            return False
+        return True
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if not self._live(key):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """return cached value, or build it with factory once even if many threads ask concurrently"""
+        missing = object()
+        if (value := self.get(key, missing)) is not missing:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # another thread may have built it while we were waiting
+            with self._lock:
+                if self._live(key):
+                    self._items.move_to_end(key)
+                    return self._items[key][1]
+            try:
+                value = factory()
+                self.set(key, value)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict[str, int]:
+        """counters for sizing the cache"""
+        return {
+            "entries": len(self._items),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskCache:
+    """thread-safe byte cache in a directory, bounded by total size, least recently used evicted first
+
+    entries survive restarts. recency is the file mtime, refreshed on every hit.
+    with a ttl the mtime stays the creation time, so entries expire ttl seconds after they were set
+    """
+
+    def __init__(self, name: str, directory: str | Path, max_bytes: int, ttl: float | None = None) -> None:
+        self.name = name
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # path -> size, oldest first
+        files = sorted(self.directory.glob("*.bin"), key=lambda path: path.stat().st_mtime)
+        self._sizes: OrderedDict[Path, int] = OrderedDict((path, path.stat().st_size) for path in files)
+        self._bytes = sum(self._sizes.values())
+        _registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key) in self._sizes
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{sha256(key.encode()).hexdigest()}.bin"
+
+    def _drop(self, path: Path) -> None:
+        """remove an entry. caller must hold the lock"""
+        self._bytes -= self._sizes.pop(path, 0)
+        path.unlink(missing_ok=True)
+        self.evictions += 1
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        with self._lock:
+            if path in self._sizes and self.ttl is not None and time.time() - path.stat().st_mtime > self.ttl:
+                self._drop(path)
+            if path not in self._sizes:
+                self.misses += 1
+                return None
+            try:
+                value = path.read_bytes()
+            except FileNotFoundError:  # removed by hand
+                self._bytes -= self._sizes.pop(path)
+                self.misses += 1
+                return None
+            if self.ttl is None:
+                os.utime(path)
+            self._sizes.move_to_end(path)
+            self.hits += 1
+            self.bytes_saved += len(value)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_bytes(value)
+        with self._lock:
+            os.replace(tmp, path)  # readers never see a partial file
+            self._bytes += len(value) - self._sizes.pop(path, 0)
+            self._sizes[path] = len(value)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._sizes)))
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self._sizes:
+                path.unlink(missing_ok=True)
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, int | float]:
+        """counters for sizing the cache"""
+        return {
+            "entries": len(self._sizes),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0,
+            "evictions": self.evictions,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+def metrics() -> dict[str, dict]:
+    """stats of all caches created in this process"""
+    return {name: cache.stats() for name, cache in _registry.items()}
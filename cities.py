@@ -0,0 +1,228 @@
+"""city lookups: name to coordinates, type-ahead search and nearest city"""
+
+import csv
+import numpy as np
+import os
+import shutil
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from hashlib import md5
+from pathlib import Path
+from typing import Iterable
+
+CSV_PATH = Path(__file__).parent / "cities.csv"
+# the docker image prebuilds it outside the mounted source tree
+BIN_DIR = Path(os.environ.get("CITIES_BIN_DIR", str(Path(__file__).parent / "cities_bin")))
+# compiled versions kept, the previous one may have been resolved by a reader that is still loading it
+KEEP_VERSIONS = 2
+
+
+def normalize(text: str) -> str:
+    """case and whitespace insensitive search key"""
+    return " ".join(text.casefold().split())
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class Strings:
+    """read-only sequence of utf-8 strings, as (start, end) offsets into a byte pool, decoded on access"""
+
+    def __init__(self, offsets: np.ndarray, pool: np.ndarray) -> None:
+        self.offsets = offsets
+        self.pool = memoryview(pool)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = self.offsets[idx].tolist()
+        return str(self.pool[start:end], "utf-8")
+
+
+def build_arrays(
+    names: Iterable[str],
+    lats: Iterable[float],
+    lons: Iterable[float],
+    tzs: Iterable[str],
+    pops: Iterable[int],
+) -> dict[str, np.ndarray]:
+    """all indexes of the city index as flat numpy arrays, strings interned in one utf-8 pool"""
+    names, tzs = list(names), list(tzs)
+    pops = np.asarray(pops, dtype="i8")
+    pool = bytearray()
+
+    def intern(texts: list[str]) -> np.ndarray:
+        offsets = np.zeros((len(texts), 2), dtype="u4")
+        for idx, text in enumerate(texts):
+            data = text.encode()
+            offsets[idx] = len(pool), len(pool) + len(data)
+            pool.extend(data)
+        return offsets
+
+    timezones = list(dict.fromkeys(tzs))
+    tz_ids = {tz: idx for idx, tz in enumerate(timezones)}
+    keys = [normalize(name) for name in names]
+    # sorted (token, id) pairs for prefix search on the whole name and each word
+    tokens = sorted((token, idx) for idx, key in enumerate(keys) for token in {key, *key.split()})
+    # trigram postings for substring search, in CSR layout: ids of grams[n] are gram_ids[gram_starts[n]:gram_starts[n + 1]]
+    postings: dict[str, set[int]] = defaultdict(set)
+    for idx, key in enumerate(keys):
+        for gram in trigrams(key):
+            postings[gram].add(idx)
+    grams = sorted(postings)
+    # unit vectors for nearest city by chord distance
+    lat, lon = np.radians(np.asarray(lats, dtype="f8")), np.radians(np.asarray(lons, dtype="f8"))
+
+    arrays = {
+        "names": intern(names),
+        "keys": intern(keys),
+        "timezones": intern(timezones),
+        "tokens": intern([token for token, _ in tokens]),
+        "grams": intern(grams),
+        "lats": np.asarray(lats, dtype="f8"),
+        "lons": np.asarray(lons, dtype="f8"),
+        "pops": pops,
+        "tz_ids": np.array([tz_ids[tz] for tz in tzs], dtype="u2"),
+        "by_name": np.array(sorted(range(len(names)), key=names.__getitem__), dtype="u4"),
+        "ranked": np.argsort(-pops, kind="stable").astype("u4"),  # most populous first
+        "token_ids": np.array([idx for _, idx in tokens], dtype="u4"),
+        "gram_starts": np.cumsum([0, *(len(postings[gram]) for gram in grams)]).astype("u4"),
+        "gram_ids": np.array([idx for gram in grams for idx in sorted(postings[gram])], dtype="u4"),
+        "xyz": np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]),
+    }
+    arrays["pool"] = np.frombuffer(bytes(pool), dtype="u1")
+    return arrays
+
+
+class CityIndex:
+    """indexes over the cities dataset, kept in numpy arrays so memory-mapped ones are shared between processes"""
+
+    def __init__(self, arrays: dict[str, np.ndarray]) -> None:
+        self.arrays = arrays
+        pool = arrays["pool"]
+        self.names = Strings(arrays["names"], pool)
+        self.keys = Strings(arrays["keys"], pool)
+        self.tokens = Strings(arrays["tokens"], pool)
+        self.grams = Strings(arrays["grams"], pool)
+        self.timezones = [*Strings(arrays["timezones"], pool)]  # a few hundred, listed as they are
+        self.lats, self.lons, self.pops = arrays["lats"], arrays["lons"], arrays["pops"]
+        self.tz_ids, self.by_name, self.ranked = arrays["tz_ids"], arrays["by_name"], arrays["ranked"]
+        self.token_ids, self.gram_starts, self.gram_ids = arrays["token_ids"], arrays["gram_starts"], arrays["gram_ids"]
+        self.xyz = arrays["xyz"]
+
+    @classmethod
+    def build(
+        cls,
+        names: Iterable[str],
+        lats: Iterable[float],
+        lons: Iterable[float],
+        tzs: Iterable[str],
+        pops: Iterable[int],
+    ) -> "CityIndex":
+        """city index built in memory"""
+        return cls(build_arrays(names, lats, lons, tzs, pops))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get(self, name: str | None) -> tuple[float, float, str] | None:
+        """lat, lon and timezone of a city"""
+        if not name:
+            return None
+        pos = bisect_left(self.by_name, name, key=self.names.__getitem__)
+        if pos == len(self.by_name) or self.names[idx := int(self.by_name[pos])] != name:
+            return None
+        return float(self.lats[idx]), float(self.lons[idx]), self.timezones[self.tz_ids[idx]]
+
+    def popular(self, limit: int) -> list[str]:
+        return [self.names[idx] for idx in self.ranked[:limit]]
+
+    def postings(self, gram: str) -> set[int]:
+        """ids of the cities containing a trigram"""
+        pos = bisect_left(self.grams, gram)
+        if pos == len(self.grams) or self.grams[pos] != gram:
+            return set()
+        return set(self.gram_ids[self.gram_starts[pos] : self.gram_starts[pos + 1]].tolist())
+
+    def search(self, query: str | None, limit: int = 50) -> list[str]:
+        """cities matching a word prefix, or a substring for 3+ characters. exact, prefix, then populous first"""
+        key = normalize(query or "")
+        if not key:
+            return self.popular(limit)
+
+        ids = set()
+        pos = bisect_left(self.tokens, key)
+        while pos < len(self.tokens) and self.tokens[pos].startswith(key):
+            ids.add(int(self.token_ids[pos]))
+            pos += 1
+        if len(key) >= 3:
+            postings = [self.postings(gram) for gram in trigrams(key)]
+            ids |= {idx for idx in set.intersection(*postings) if key in self.keys[idx]}
+
+        keys = {idx: self.keys[idx] for idx in ids}
+
+        def rank(idx: int) -> tuple:
+            return keys[idx] != key, not keys[idx].startswith(key), -self.pops[idx]
+
+        return [self.names[idx] for idx in sorted(ids, key=rank)[:limit]]
+
+    def nearest(self, lat: float, lon: float) -> str:
+        """closest city to a coordinate"""
+        lat, lon = np.radians(lat), np.radians(lon)
+        point = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+        return self.names[int(np.argmax(self.xyz @ point))]
+
+
+# binary dataset ===============================================================
+
+
+def csv_digest(csv_path: Path) -> str:
+    return md5(csv_path.read_bytes()).hexdigest()
+
+
+def compile_cities(csv_path: Path = CSV_PATH, bin_dir: Path = BIN_DIR) -> None:
+    """compile the cities CSV into one .npy file per index array, in a new version directory linked from bin_dir
+
+    source.md5 records the CSV it was compiled from
+    """
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        records = list(csv.DictReader(f))
+    arrays = build_arrays(
+        names=[record["city"] for record in records],
+        lats=[float(record["lat"]) for record in records],
+        lons=[float(record["lon"]) for record in records],
+        tzs=[record["tz"] for record in records],
+        pops=[int(record["pop"]) for record in records],
+    )
+
+    # every build is a new version directory, swapped in by replacing the bin_dir symlink,
+    # so readers always find the old or the new dataset, never none or half of one
+    version = bin_dir.with_name(f"{bin_dir.name}.{os.getpid()}.{time.time_ns()}")
+    version.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(version / f"{name}.npy", array)
+    (version / "source.md5").write_text(csv_digest(csv_path))
+    if bin_dir.is_dir() and not bin_dir.is_symlink():
+        shutil.rmtree(bin_dir, ignore_errors=True)  # compiled before versioning
+    link = version.with_name(f"{version.name}.link")
+    link.symlink_to(version.name)
+    os.replace(link, bin_dir)
+
+    versions = [path for path in bin_dir.parent.glob(f"{bin_dir.name}.*.*") if not path.is_symlink()]
+    versions.sort(key=lambda path: int(path.name.rsplit(".", 1)[1]))  # by build time
+    for path in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_cities(csv_path: Path = CSV_PATH, bin_dir: Path = BIN_DIR) -> CityIndex:
+    """city index over the memory-mapped dataset, compiled first if missing or compiled from another CSV"""
+    source = bin_dir / "source.md5"
+    if not source.exists() or source.read_text() != csv_digest(csv_path):
+        compile_cities(csv_path, bin_dir)
+    # one version for all arrays, even if another worker swaps in a newer one meanwhile
+    bin_dir = bin_dir.resolve()
+    # plain ndarray views of the mapped pages, indexing a np.memmap wraps every result in another memmap
+    return CityIndex({path.stem: np.load(path, mmap_mode="r").view(np.ndarray) for path in bin_dir.glob("*.npy")})
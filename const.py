@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 from datetime import date as Date
 from natal.config import Display, Orb
@@ -24,6 +25,16 @@ DEFAULT_OPTS = {
     "chart_type": "birth_page",
     "selected_chart_type": "birth_page",
     "stepper_unit": "day",
+    "timeline_pos": None,  # see utils.timeline_pos
+    "settings_version": None,
+    "pdf_job": None,
+    "export_job": None,
+    "charts_query": "",
+    "charts_page": 1,
+    # what the last runs of the chart and sidebar fragments were drawn from
+    "page_state": None,
+    "charts_state": None,
+    "toasts": [],
 }
 
 DEFAULT_INPUTS = {
@@ -73,6 +84,31 @@ def set_default_values():
 # =============================================================================
 
 ROW_HEIGHT = 35
+
+# process-wide caches, sized by the hit / miss / eviction counters in `cache.metrics()`
+CHART_CACHE_SIZE = 256
+CHART_CACHE_TTL = 60 * 60 * 6  # seconds
+DATA_CACHE_SIZE = 1024  # natal.Data objects, roughly 30 KB each
+ANALYSIS_CACHE_SIZE = 256  # stats grids per chart, shared by the stats panel, PDF report and AI context
+STATS_HTML_CACHE_SIZE = 2048  # stats panel sections, 7 per chart and language
+AI_PROMPT_CACHE_SIZE = 512  # AI system prompts, roughly 10 KB each, per chart, chart type and language
+TIMELINE_CACHE_SIZE = 64
+TIMELINE_STEPS = 30  # steps on each side of the transit datetime
+# transit charts built ahead on each side of the transit datetime, the whole batch would crowd the shared SVG cache
+TIMELINE_PREWARM = 10
+EVENTS_CACHE_SIZE = 64
+EXACT_ASPECT_DAYS = 90
+SOLAR_RETURN_CACHE_SIZE = 4096  # one datetime per chart and year
+SOLAR_RETURN_SPAN = 5  # years precomputed on each side of a requested year
+SAVED_CHARTS_CACHE_SIZE = 256  # pages of the saved charts table
+SAVED_CHARTS_PAGE_SIZE = 20
+SETTINGS_CACHE_SIZE = 4096  # general options per logged in user
+AI_CLIENT_CACHE_SIZE = 256  # OpenRouter clients, one per API key, all on one connection pool
+AI_HISTORY_TOKENS = 4000  # estimated tokens of earlier turns sent with a question, older turns are left out
+AI_EARLIER_QUESTIONS = 10  # questions of left out turns listed for the model
+AI_KEEPALIVE_EXPIRY = 120  # seconds an idle connection to OpenRouter is kept for the next chat
+AI_POLL_INTERVAL = 0.25  # seconds between renders of an answer being streamed in the background
+CITY_OPTIONS = 300  # cities sent to the city selectbox, searched on the server beyond that
 PDF_COLOR = dict(light=":material/palette:", mono=":material/contrast:")
 
 LANGS = ["English", "中文"]
@@ -107,9 +143,14 @@ I18N = {
     # utils ui
     "gen_pdf": ("Generate PDF", "生成 PDF"),
     "download_pdf": ("Download PDF", "下載 PDF"),
+    "pdf_pending": ("Generating PDF, {ahead} ahead in queue", "正在生成 PDF，前面還有 {ahead} 個"),
+    "pdf_busy": ("Too many PDFs in progress, please try again shortly", "生成 PDF 的請求太多，請稍後再試"),
+    "pdf_failed": ("PDF generation failed", "生成 PDF 失敗"),
     "save_chart": ("Save Chart", "保存星盤"),
     "prev": ("Prev ", "上一"),
     "next": ("Next ", "下一"),
+    "timeline": ("Timeline", "時間軸"),
+    "exact_aspects": ("Exact Aspects", "精確相位"),
     # orbs
     "orbs": ("Orbs", "容許度"),
     "orb": ("Orb", "容許度"),
@@ -156,7 +197,10 @@ I18N = {
     "timezone": ("Timezone", "時區"),
     "timezone_placeholder": ("select timezone", "選擇時區"),
     "city_placeholder": ("select city", "選擇城市"),
-    "city_help": ("select or type in the city name", "選擇或輸入城市名稱"),
+    "city_help": (
+        "select or type in the city name, press enter to search all cities",
+        "選擇或輸入城市名稱，按 Enter 搜尋所有城市",
+    ),
     "year": ("yr", "年"),
     "month": ("mo", "月"),
     "week": ("wk", "週"),
@@ -172,6 +216,12 @@ I18N = {
     "age": ("Age", "年齡"),
     "transit_date": ("Transit Date", "行運日期"),
     "no_saved_charts": ("No saved charts", "沒有星盤存檔"),
+    "search_charts": ("Search name or city", "搜尋名字或城市"),
+    "page": ("Page", "頁"),
+    "export_pdfs": ("Export PDFs", "匯出 PDF"),
+    "export_progress": ("{done} / {total} PDFs", "{done} / {total} 個 PDF"),
+    "download_zip": ("Download ZIP", "下載 ZIP"),
+    "export_failed": ("PDF export failed", "匯出 PDF 失敗"),
     "chart_created": ("Chart Created", "星盤已保存"),
     "chart_updated": ("Chart Updated", "星盤已更新"),
     # house sys
@@ -202,10 +252,11 @@ I18N = {
         "免費額度已用完，請稍後再試。",
     ),
     "ai_model": ("AI Model", "AI 模型"),
-    "model_busy": ("model busy, please try another model.", "模型忙碌，請嘗試其他模型。"),
-    "model_unavailable": (
-        "model unavailable, please use another model.",
-        "模型不可用，請使用其他模型。",
+    "models_busy": ("all models busy, please try again later.", "所有模型忙碌，請稍後再試。"),
+    "answered_by": ("answered by {model}", "由 {model} 回答"),
+    "models_unavailable": (
+        "no answer from {models}, please try again later.",
+        "{models} 沒有回應，請稍後再試。",
     ),
     # stats
     "basic_info": ("Basic Info", "基本資料"),
@@ -263,3 +314,24 @@ SYMBOLS = {
     "dsc": "Dsc",
     "mc": "MC",
 }
+
+# sqlite
+DB_PATH = "data.db"
+DB_POOL_SIZE = 8  # read connections shared by all sessions
+DB_BATCH_SIZE = 64  # queued writes committed in one transaction
+
+# PDF rendering in worker processes, sized so a burst of prints leaves CPU for chart rendering
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "2"))
+PDF_QUEUE_DEPTH = int(os.environ.get("PDF_QUEUE_DEPTH", "8"))  # jobs queued or running, across all sessions
+PDF_POLL_INTERVAL = 0.5  # seconds
+EXPORT_WINDOW = 8  # reports of a batch export in flight, bounds its memory
+EXPORT_CHUNK = 50  # saved charts read from the database at a time
+PDF_CACHE_DIR = "cache/pdf"
+PDF_CACHE_BYTES = 256 * 1024**2  # reports are roughly 100 KB
+PDF_TEMPLATE_VERSION = 1  # bump when pdf_html changes the report, so cached PDFs are rendered again
+
+# answers to the question ideas, per chart, question, model and language
+AI_ANSWER_CACHE_DIR = "cache/ai"
+AI_ANSWER_CACHE_BYTES = 64 * 1024**2  # answers are roughly 3 KB
+AI_ANSWER_CACHE_TTL = 60 * 60 * 24 * 7  # seconds, models are updated behind the same name
+AI_PREWARM = int(os.environ.get("AI_PREWARM", "0"))  # question ideas answered in the background for a new chart
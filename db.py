@@ -0,0 +1,158 @@
+"""SQLite access shared by all sessions: pooled WAL readers and one batching writer thread"""
+
+import atexit
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+type Write = Callable[[sqlite3.Connection], Any]
+
+
+class Database:
+    """WAL mode SQLite database
+
+    - reads borrow a connection from a pool, so sessions read concurrently without sharing a cursor
+    - writes are queued to a single writer thread, which runs everything queued so far in one transaction
+      and commits once. each write runs in its own savepoint, a failing write doesn't undo the others
+    - connections live as long as the process, so sqlite's per connection statement cache keeps the
+      app's handful of queries prepared
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        pool_size: int = 8,
+        batch_size: int = 64,
+        busy_timeout: float = 5,
+    ) -> None:
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.busy_timeout = busy_timeout
+        self.writes = 0
+        self.commits = 0
+
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._writer.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints, safe with WAL
+        self._readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        for _ in range(pool_size):
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON")
+            self._readers.put(conn)
+
+        self._queue: queue.Queue[tuple[Write, Future] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit, transactions are explicit
+        return sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+
+    # reads ====================================================================
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """borrow a read-only connection, blocks while all are in use"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def fetchone(self, sql: str, params: tuple | list = ()) -> tuple | None:
+        with self.reader() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: tuple | list = ()) -> list[tuple]:
+        with self.reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    # writes ===================================================================
+
+    def submit(self, write: Write) -> Future:
+        """queue a write, a function of the writer connection. the future resolves once it is committed"""
+        future = Future()
+        self._queue.put((write, future))
+        return future
+
+    def transact(self, write: Write) -> Any:
+        """run a write atomically and wait for its commit"""
+        return self.submit(write).result()
+
+    def execute(self, sql: str, params: tuple | list = ()) -> int:
+        """run a write statement, wait for its commit and return the affected row count"""
+        return self.transact(lambda conn: conn.execute(sql, params).rowcount)
+
+    def flush(self) -> None:
+        """wait until every write queued so far is committed"""
+        self.transact(lambda conn: None)
+
+    def _write_loop(self) -> None:
+        while (item := self._queue.get()) is not None:
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # stop after this batch
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: list[tuple[Write, Future]]) -> None:
+        conn = self._writer
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for write, _ in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((write(conn), None))
+                    conn.execute("RELEASE write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results.append((None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.writes += len(batch)
+        self.commits += 1
+        for (_, future), (result, error) in zip(batch, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # ==========================================================================
+
+    def stats(self) -> dict[str, int]:
+        return {"writes": self.writes, "commits": self.commits, "queued": self._queue.qsize()}
+
+    def close(self) -> None:
+        """commit queued writes and close all connections"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
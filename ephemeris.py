@@ -0,0 +1,80 @@
+"""memoized natal.Data shared by all sessions in the process"""
+
+import streamlit as st
+import swisseph as swe
+from cache import LRUCache
+from const import DATA_CACHE_SIZE, SOLAR_RETURN_CACHE_SIZE, SOLAR_RETURN_SPAN
+from datetime import datetime, timedelta, timezone
+from natal import Config, Data
+from timeline import julian_day, shift, utc_of_julian_day
+
+
+@st.cache_resource
+def data_cache() -> LRUCache:
+    return LRUCache("natal_data", max_entries=DATA_CACHE_SIZE)
+
+
+@st.cache_resource
+def solar_return_cache() -> LRUCache:
+    return LRUCache("solar_return", max_entries=SOLAR_RETURN_CACHE_SIZE)
+
+
+def data_key(lat: float, lon: float, utc_dt: datetime, config: Config) -> tuple:
+    """everything natal.Data computes positions, houses and aspects from"""
+    return (
+        utc_dt,
+        lat,
+        lon,
+        config.house_sys,
+        tuple(config.orb.model_dump().items()),
+        tuple(config.display.model_dump().items()),
+    )
+
+
+def key_of(data: Data) -> tuple:
+    return data_key(data.lat, data.lon, data.utc_dt, data.config)
+
+
+def fork(data: Data, name: str) -> Data:
+    """shallow copy sharing the computed bodies, with its own name and config
+
+    callers may mutate the config of the fork (eg. theme in `pdf_html`) without touching the cached original
+    """
+    forked = Data.__new__(Data)
+    forked.__dict__.update(data.__dict__)
+    forked.name = name
+    # bypass the config setter, which recomputes everything
+    forked._config = data.config.model_copy(deep=True)
+    return forked
+
+
+def shared_data(name: str, lat: float, lon: float, utc_dt: datetime, config: Config) -> Data:
+    """natal.Data computed once per process for the same moment, place and config"""
+    key = data_key(lat, lon, utc_dt, config)
+    data = data_cache().get_or_set(key, lambda: Data(name=name, lat=lat, lon=lon, utc_dt=utc_dt, config=config))
+    return fork(data, name)
+
+
+def solar_returns(data: Data, years: range) -> dict[int, datetime]:
+    """UTC instants the Sun returns to its natal longitude, one per year, same search as natal.Data.solar_return"""
+    output = {}
+    for year in years:
+        start = shift(data.utc_dt, "year", year - data.utc_dt.year) - timedelta(days=1)
+        jd = swe.solcross_ut(data.sun.degree, julian_day(start))
+        output[year] = utc_of_julian_day(jd)
+    return output
+
+
+def solar_return_dt(data: Data, year: int) -> datetime:
+    """cached solar return instant of a natal chart
+
+    a miss computes SOLAR_RETURN_SPAN years on each side in one batch, so flipping or stepping years is free
+    """
+    cache = solar_return_cache()
+    key = (data.utc_dt, data.lat, data.lon)
+    if (utc_dt := cache.get(key + (year,))) is None:
+        span = range(year - SOLAR_RETURN_SPAN, year + SOLAR_RETURN_SPAN + 1)
+        for yr, dt in solar_returns(data, span).items():
+            cache.set(key + (yr,), dt)
+        utc_dt = cache.get(key + (year,))
+    return utc_dt
@@ -0,0 +1,244 @@
+"""async chat completions raced across models, with failover and hedged requests, on one shared connection pool"""
+
+import asyncio
+import httpx
+import re
+import streamlit as st
+import threading
+import time
+from cache import LRUCache
+from concurrent.futures import Future
+from const import AI_CLIENT_CACHE_SIZE, AI_EARLIER_QUESTIONS, AI_KEEPALIVE_EXPIRY
+from dataclasses import dataclass, field
+from openai import APIStatusError, AsyncOpenAI, AsyncStream, DefaultAsyncHttpxClient
+from textwrap import shorten
+from typing import Any, AsyncIterator, Coroutine, TypeVar
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:  # httpx[http2] not installed, keep-alive HTTP/1.1 connections
+    HTTP2 = False
+
+T = TypeVar("T")
+# english words, numbers in groups of 3, any other character, roughly how BPE tokenizers split text
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|[0-9]{1,3}|\S")
+DRAIN_TIMEOUT = 0.1  # seconds to read the end of a response closed early, before giving up its connection
+
+
+def is_fatal(error: BaseException) -> bool:
+    """errors every model would fail with too: invalid key or no credits"""
+    return isinstance(error, APIStatusError) and error.status_code in (401, 402)
+
+
+async def first_token(client: AsyncOpenAI, model: str, messages: list[dict]) -> tuple[AsyncStream, str]:
+    """open a streamed completion and wait for its first content"""
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True)
+    try:
+        async for chunk in stream:
+            if chunk.choices and (content := chunk.choices[0].delta.content):
+                return stream, content
+        return stream, ""
+    except BaseException:  # including cancellation by a faster model
+        await stream.close()
+        raise
+
+
+async def race(
+    client: AsyncOpenAI,
+    models: list[str],
+    messages: list[dict],
+    timeout: float,
+    hedge_after: float | None = None,
+) -> AsyncIterator[tuple[str, str]]:
+    """stream the answer of the first model to send a token, as (model, content) pairs
+
+    models are asked in order. a model that fails, or sends nothing for `timeout` seconds, is replaced by the next.
+    with `hedge_after`, a model silent for that long is raced by the next one, and the slower is cancelled.
+    raises the last error if no model answers
+    """
+    queue = list(models)
+    attempts: dict[asyncio.Task, str] = {}
+    winner = error = None
+
+    def ask_next() -> None:
+        model = queue.pop(0)
+        attempts[asyncio.create_task(asyncio.wait_for(first_token(client, model, messages), timeout))] = model
+
+    ask_next()
+    try:
+        while attempts and winner is None:
+            hedge = hedge_after if queue else None
+            done, _ = await asyncio.wait(attempts, timeout=hedge, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                ask_next()
+            for task in done:
+                model = attempts.pop(task)
+                if (error := task.exception()) is not None:
+                    if is_fatal(error):
+                        raise error
+                    if queue:
+                        ask_next()
+                elif winner is None:
+                    winner = model, *task.result()
+                else:
+                    await task.result()[0].close()
+    finally:
+        for task in attempts:
+            task.cancel()
+
+    if winner is None:
+        raise error
+    model, stream, content = winner
+    try:
+        if content:
+            yield model, content
+        async for chunk in stream:
+            if chunk.choices and (content := chunk.choices[0].delta.content):
+                yield model, content
+    finally:
+        await stream.close()
+
+
+# chat history =================================================================
+
+
+def count_tokens(text: str) -> int:
+    """estimated tokens of a text, a word takes 1 token per 4 letters and a CJK character or symbol 1 token"""
+    return sum(max(1, len(token) // 4) if token.isascii() else 1 for token in TOKEN_PATTERN.findall(text))
+
+
+def compact_history(messages: list[dict], budget: int) -> list[dict]:
+    """system message, the new question and the latest turns that fit in `budget` tokens
+
+    older turns are dropped, and their questions listed in a short note so the model knows what was discussed
+    """
+    system, *history = messages
+    turns: list[list[dict]] = []
+    for message in history:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+
+    kept = [turns.pop()]
+    used = sum(count_tokens(message["content"]) for message in kept[0])
+    while turns and (used := used + sum(count_tokens(message["content"]) for message in turns[-1])) <= budget:
+        kept.insert(0, turns.pop())
+
+    compacted = [system]
+    if turns:
+        questions = [shorten(turn[0]["content"], 100, placeholder="...") for turn in turns[-AI_EARLIER_QUESTIONS:]]
+        note = "Earlier questions of the user, answers left out:\n" + "\n".join(f"- {q}" for q in questions)
+        compacted.append({"role": "developer", "content": note})
+    return compacted + [message for turn in kept for message in turn]
+
+
+# connection pool ==============================================================
+
+
+class DrainOnClose(httpx.AsyncByteStream):
+    """response body that is read to its end when closed, so its HTTP/1.1 connection goes back to the pool
+
+    openai streams stop reading at `data: [DONE]`, before the end of the chunked body, which would close the connection
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream) -> None:
+        self.stream = stream
+        # one iterator, resumed by aclose
+        self.chunks = aiter(stream)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            async with asyncio.timeout(DRAIN_TIMEOUT):
+                async for _ in self.chunks:
+                    pass
+        except TimeoutError:  # still answering, eg. a model that lost the race
+            pass
+        finally:
+            await self.stream.aclose()
+
+
+async def drain_on_close(response: httpx.Response) -> None:
+    response.stream = DrainOnClose(response.stream)
+
+
+@st.cache_resource
+def http_client() -> httpx.AsyncClient:
+    """keep-alive connection pool of every chat, so a new chat skips the TCP and TLS handshakes"""
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=AI_KEEPALIVE_EXPIRY)
+    return DefaultAsyncHttpxClient(http2=HTTP2, limits=limits, event_hooks={"response": [drain_on_close]})
+
+
+@st.cache_resource
+def client_cache() -> LRUCache:
+    return LRUCache("ai_clients", max_entries=AI_CLIENT_CACHE_SIZE)
+
+
+def shared_client(base_url: str, api_key: str) -> AsyncOpenAI:
+    """client per base URL and API key, borrowing connections from the shared pool
+
+    evicted clients are not closed, the pool they share stays open
+    """
+
+    def build() -> AsyncOpenAI:
+        # no retries of the same model, the next model is asked instead
+        return AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client())
+
+    return client_cache().get_or_set((base_url, api_key), build)
+
+
+# script threads ===============================================================
+
+
+@st.cache_resource
+def event_loop() -> asyncio.AbstractEventLoop:
+    """one event loop in a background thread, running the model requests of every session"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm", daemon=True).start()
+    return loop
+
+
+def submit(coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+    """run a coroutine on the shared event loop, without waiting for it"""
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+
+
+@dataclass
+class Reply:
+    """answer written into a buffer by a task on the shared event loop, and read by script runs"""
+
+    text: str = ""
+    model: str | None = None
+    error: Exception | None = None
+    done: bool = False
+    started: float = field(default_factory=time.monotonic)
+    future: Future | None = field(default=None, repr=False)
+
+    def cancel(self) -> None:
+        if self.future:
+            self.future.cancel()
+
+
+async def fill(reply: Reply, answer: AsyncIterator[tuple[str, str]]) -> None:
+    try:
+        async for model, content in answer:
+            reply.model = model
+            reply.text += content
+    except Exception as error:
+        reply.error = error
+    finally:
+        # also when cancelled, so the response is not left open
+        await answer.aclose()
+        reply.done = True
+
+
+def stream(answer: AsyncIterator[tuple[str, str]]) -> Reply:
+    """answer in the background, no script thread waits for the model"""
+    reply = Reply()
+    reply.future = submit(fill(reply, answer))
+    return reply
@@ -1,16 +1,19 @@
 import streamlit as st
 from archive import delete_chart
+from cache import metrics
 from const import SESS, set_default_values
 from ui import (
     ai_ui,
     chart_ui,
+    charts_state,
     input_ui,
+    page_state,
     segmented_ui,
     sidebar_ui,
     stats_ui,
     utils_ui,
 )
-from utils import i, is_form_valid, natal_data
+from utils import i, is_form_valid, natal_data, rerun_app_if_changed, timed_fragment
 
 
 def handle_delete_request():
@@ -33,6 +36,13 @@ st.logo("static/astromate-logo.png")
 st.html("style.css")
 
 
+def show_metrics():
+    """process-wide cache counters at `?metrics`, for sizing the caches"""
+    if "metrics" in st.query_params:
+        st.json(metrics())
+        st.stop()
+
+
 def input(title1: str, icon2: str | None = None, title2: str | None = None):
     with st.expander(title1, expanded=True):
         input_ui(1)
@@ -43,31 +53,43 @@ def input(title1: str, icon2: str | None = None, title2: str | None = None):
                 input_ui(2)
 
 
-set_default_values()
-handle_delete_request()
-sidebar_ui()
-segmented_ui()
+@timed_fragment("chart")
+def chart_page():
+    """inputs, chart and stepper, a stepper click reruns them with the nested stats and AI fragments only"""
+    # a chart saved by this fragment is listed in the sidebar
+    rerun_app_if_changed("charts_state", charts_state())
+    try:
+        # input data for different chart types
+        match SESS.chart_type:
+            case "birth_page":
+                input(i("birth_data"))
+            case "synastry_page":
+                input(i("birth_data"), "group", i("synastry_data"))
+            case "transit_page":
+                input(i("birth_data"), "calendar_clock", i("transit_data"))
+            case "solar_return_page":
+                input(i("birth_data"))
 
-# input data for different chart types
-match SESS.chart_type:
-    case "birth_page":
-        input(i("birth_data"))
-    case "synastry_page":
-        input(i("birth_data"), "group", i("synastry_data"))
-    case "transit_page":
-        input(i("birth_data"), "calendar_clock", i("transit_data"))
-    case "solar_return_page":
-        input(i("birth_data"))
+        data1 = natal_data(1) if is_form_valid(1) else None
+        if not data1:
+            return
 
-data1 = natal_data(1) if is_form_valid(1) else None
-if not data1:
-    st.stop()
+        data2 = natal_data(2) if is_form_valid(2) else None
+        if SESS.chart_type in ["synastry_page", "transit_page"] and not data2:
+            return
 
-data2 = natal_data(2) if is_form_valid(2) else None
-if SESS.chart_type in ["synastry_page", "transit_page"] and not data2:
-    st.stop()
+        chart_ui(data1, data2)
+        utils_ui(data1, data2)
+        stats_ui(data1, data2)
+        ai_ui(data1, data2)
+    finally:
+        SESS.page_state = page_state()
 
-chart_ui(data1, data2)
-utils_ui(data1, data2)
-stats_ui(data1, data2)
-ai_ui(data1, data2)
+
+set_default_values()
+show_metrics()
+handle_delete_request()
+with st.sidebar:
+    sidebar_ui()
+segmented_ui()
+chart_page()
@@ -0,0 +1,243 @@
+"""PDF reports rendered by a long-lived WeasyPrint renderer"""
+
+import atexit
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+from pathlib import Path
+from typing import Iterable, Iterator, Literal
+from uuid import uuid4
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+PDF_CSS = Path(__file__).parent / "pdf.css"
+# exercises font discovery, including the CJK fallback
+WARM_UP_HTML = "<main><div class='section'><div class='title'>AstroMate 星盤</div></div></main>"
+
+
+class PdfRenderer:
+    """renders report HTML to PDF, with fonts and the report stylesheet loaded once
+
+    - FontConfiguration: fontconfig / pango font discovery, slow with large CJK fonts installed
+    - CSS: pdf.css parsed and compiled once, applied to every report
+    - cache: images decoded once across reports
+    """
+
+    def __init__(self, css_path: Path = PDF_CSS) -> None:
+        self.font_config = FontConfiguration()
+        self.css = CSS(string=css_path.read_text(), font_config=self.font_config)
+        self.cache = {}
+        # pango font maps are not safe to share between threads
+        self._lock = threading.Lock()
+        self.render(WARM_UP_HTML)
+
+    def render(self, html: str) -> bytes:
+        """PDF bytes of a report"""
+        with self._lock:
+            return HTML(string=html).write_pdf(
+                stylesheets=[self.css],
+                font_config=self.font_config,
+                cache=self.cache,
+            )
+
+
+# background rendering =========================================================
+# workers are plain subprocesses running this file: multiprocessing would re-run the app's
+# main.py in every worker, since streamlit installs the script as the __main__ module
+
+
+def serve() -> None:
+    """worker loop: length-prefixed HTML on stdin, status byte and length-prefixed PDF or error on stdout"""
+    # keep stdout for replies, anything printed by libraries goes to stderr
+    replies = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    requests = sys.stdin.buffer
+    renderer = PdfRenderer()
+    while header := requests.read(4):
+        html = requests.read(int.from_bytes(header)).decode()
+        try:
+            status, body = b"1", renderer.render(html)
+        except Exception as e:
+            status, body = b"0", repr(e).encode()
+        replies.write(status + len(body).to_bytes(4) + body)
+        replies.flush()
+
+
+class Worker:
+    """a warm renderer in a subprocess"""
+
+    def __init__(self) -> None:
+        self.proc = subprocess.Popen([sys.executable, __file__], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def render(self, html: str) -> bytes:
+        body = html.encode()
+        try:
+            self.proc.stdin.write(len(body).to_bytes(4) + body)
+            self.proc.stdin.flush()
+        except OSError as e:  # died while idle, eg. BrokenPipeError
+            raise RuntimeError(f"PDF worker exited with code {self.proc.wait()}") from e
+        header = self.proc.stdout.read(5)
+        if len(header) < 5:
+            raise RuntimeError(f"PDF worker exited with code {self.proc.wait()}")
+        reply = self.proc.stdout.read(int.from_bytes(header[1:]))
+        if header[:1] != b"1":
+            raise RuntimeError(reply.decode())
+        return reply
+
+    def close(self) -> None:
+        try:
+            self.proc.stdin.close()
+        except OSError:  # already exited
+            pass
+        self.proc.wait()
+
+
+class QueueFull(Exception):
+    """too many PDF jobs pending"""
+
+
+# single prints are dispatched before export reports, whenever they were queued
+PRINT, EXPORT, STOP = 0, 1, 2
+
+
+class PdfQueue:
+    """renders PDFs in a bounded pool of worker processes, off the script threads and their GIL
+
+    at most `max_jobs` jobs are queued or running, further submits raise QueueFull.
+    jobs are looked up by id, so a session only has to keep the id of its job.
+    finished jobs are dropped `keep` seconds after submission, in case their session never collects them
+    """
+
+    def __init__(self, workers: int = 2, max_jobs: int = 8, keep: float = 600) -> None:
+        self.max_jobs = max_jobs
+        self.keep = keep
+        self._idle: queue.Queue[Worker] = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(Worker())
+        # (priority, order, future, html), a STOP item ends a dispatch thread
+        self._pending: queue.PriorityQueue = queue.PriorityQueue()
+        self._order = count()
+        # one dispatch thread per worker, so a running job always finds an idle worker
+        self._threads = [threading.Thread(target=self._dispatch, name=f"pdf_{n}", daemon=True) for n in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        self._jobs: dict[str, tuple[float, Future]] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _dispatch(self) -> None:
+        while (item := self._pending.get())[0] != STOP:
+            _, _, future, html = item
+            if not future.set_running_or_notify_cancel():
+                continue  # discarded while queued
+            try:
+                future.set_result(self._render(html))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _put(self, html: str, priority: int) -> Future:
+        future = Future()
+        self._pending.put((priority, next(self._order), future, html))
+        return future
+
+    def _render(self, html: str) -> bytes:
+        worker = self._idle.get()
+        try:
+            return worker.render(html)
+        finally:
+            if worker.proc.poll() is not None:
+                worker = Worker()  # crashed, eg. out of memory
+            self._idle.put(worker)
+
+    def submit(self, html: str) -> str:
+        """queue a report, return the job id"""
+        now = time.monotonic()
+        with self._lock:
+            for job_id, (created, job) in list(self._jobs.items()):
+                if job.done() and now - created > self.keep:
+                    del self._jobs[job_id]
+            if sum(not job.done() for _, job in self._jobs.values()) >= self.max_jobs:
+                raise QueueFull
+            job_id = uuid4().hex
+            self._jobs[job_id] = (now, self._put(html, PRINT))
+        return job_id
+
+    def ahead(self, job_id: str) -> int:
+        """number of unfinished jobs submitted before this one"""
+        with self._lock:
+            ids = list(self._jobs)
+            jobs = [job for _, job in self._jobs.values()]
+        if job_id not in ids:
+            return 0
+        return sum(not job.done() for job in jobs[: ids.index(job_id)])
+
+    def status(self, job_id: str) -> Literal["queued", "running", "done", "failed", "unknown"]:
+        if (item := self._jobs.get(job_id)) is None:
+            return "unknown"
+        _, job = item
+        if job.done():
+            return "failed" if job.cancelled() or job.exception() else "done"
+        return "running" if job.running() else "queued"
+
+    def result(self, job_id: str) -> bytes:
+        """PDF bytes of a finished job, raises its error if it failed"""
+        _, job = self._jobs[job_id]
+        return job.result()
+
+    def discard(self, job_id: str) -> None:
+        """forget a job, cancelling it if not started yet"""
+        with self._lock:
+            item = self._jobs.pop(job_id, None)
+        if item is not None:
+            item[1].cancel()
+
+    def render_many(self, htmls: Iterable[str | bytes], window: int) -> Iterator[Future]:
+        """render many reports on the same workers, yielding their futures in order
+
+        bytes are PDFs rendered already, eg. from a cache, passed through as done futures to keep their place
+
+        at most `window` reports are built, rendering or rendered but not yet consumed, so memory stays bounded
+        however many reports there are. they don't count against max_jobs: single prints are dispatched first,
+        so an export only holds them up by the reports already rendering. closing the iterator early cancels
+        the reports not started yet
+        """
+        pending = deque()
+        try:
+            for html in htmls:
+                if isinstance(html, bytes):
+                    pending.append(future := Future())
+                    future.set_result(html)
+                else:
+                    pending.append(self._put(html, EXPORT))
+                if len(pending) >= window:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            # the consumer stopped early, nobody reads the rest
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        while True:
+            try:
+                item = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            item[2].cancel()
+        for _ in self._threads:
+            self._pending.put((STOP, next(self._order), None, ""))
+        for thread in self._threads:
+            thread.join()
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,291 @@
+"""Time to first token of chat answers against a local OpenRouter stub.
+
+models: one model (before) vs hedged models (after).
+each stub model answers in 0.2 s, but 1 in 4 requests stalls for 2 s before its first token
+
+clients: a new client per chat (before) vs the shared connection pool (after), over TLS.
+the first question of each chat, as asked after every chart change. the stub answers at once, and delays each new
+connection by 2 round trips for the TCP and TLS handshakes, at 0 ms (loopback) and 25 ms round trip times
+
+history: every turn of a 30 turn conversation sent (before) vs the history compacted to its token budget (after).
+the stub reads the prompt at 5000 tokens per second before its first token, each answer is 500 tokens
+
+sessions: 64 sessions asking at once, each answer streamed for 2 s. consumed by the script thread of each session
+(before) vs streamed into a buffer on the event loop and polled every 0.25 s by the script threads (after)
+"""
+
+import asyncio
+import certifi
+import json
+import os
+import random
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from concurrent.futures import ThreadPoolExecutor
+from const import AI_HISTORY_TOKENS, AI_POLL_INTERVAL
+from llm import compact_history, count_tokens, event_loop, race, shared_client, stream, submit
+from openai import AsyncOpenAI
+
+REQUESTS = 40
+MODELS = ["a", "b", "c"]
+FAST, STALL, STALL_RATE = 0.2, 2.0, 0.25
+HEDGE_AFTER = 0.5
+CHATS = 40
+RTTS = [0, 0.025]
+TURNS = 30
+PREFILL = 1 / 5000  # seconds per prompt token
+SESSIONS = 64
+TOKEN_DELAY = 0.5  # seconds between the tokens of a slow answer
+rng = random.Random(1)
+
+
+class Stub(BaseHTTPRequestHandler):
+    """streamed chat completions, in the server sent events format of the OpenAI API"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # small SSE writes are sent at once, like a real API server
+
+    def setup(self) -> None:
+        self.server.connections += 1
+        time.sleep(2 * self.server.rtt)
+        super().setup()
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if self.server.stalls:
+            time.sleep(STALL if rng.random() < STALL_RATE else FAST)
+        time.sleep(self.server.prefill * sum(count_tokens(message["content"]) for message in request["messages"]))
+        for token in ["the ", "stars ", "say ", "hi"]:
+            chunk = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": request["model"],
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            self.send_event(json.dumps(chunk))
+            time.sleep(self.server.token_delay)
+        self.send_event("[DONE]")
+        self.send_chunk(b"")
+
+    def send_event(self, data: str) -> None:
+        self.send_chunk(f"data: {data}\n\n".encode())
+
+    def send_chunk(self, data: bytes) -> None:
+        try:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):  # cancelled by the client
+            self.close_connection = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # sessions connecting at once
+
+
+def serve(
+    stalls: bool = True,
+    rtt: float = 0,
+    tls: ssl.SSLContext | None = None,
+    prefill: float = 0,
+    token_delay: float = 0,
+) -> StubServer:
+    server = StubServer(("127.0.0.1", 0), Stub)
+    server.stalls, server.rtt, server.prefill, server.token_delay = stalls, rtt, prefill, token_delay
+    server.connections = 0
+    if tls:
+        server.socket = tls.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheme = "https" if tls else "http"
+    server.base_url = f"{scheme}://127.0.0.1:{server.server_port}/v1"
+    return server
+
+
+def tls_context(directory: str) -> ssl.SSLContext:
+    """self-signed certificate of the stub, trusted by the clients along with the usual CA bundle"""
+    key, cert, bundle = (os.path.join(directory, name) for name in ["key.pem", "cert.pem", "bundle.pem"])
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-keyout", key, "-out", cert]
+        + ["-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True,
+        capture_output=True,
+    )
+    with open(bundle, "w") as file:
+        file.write(Path(certifi.where()).read_text() + Path(cert).read_text())
+    os.environ["SSL_CERT_FILE"] = bundle
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def first_token_time(client: AsyncOpenAI, models: list[str], hedge_after: float | None) -> float:
+    start = time.perf_counter()
+    answer = race(client, models, [{"role": "user", "content": "hi"}], timeout=30, hedge_after=hedge_after)
+    try:
+        await anext(answer)
+        return time.perf_counter() - start
+    finally:
+        await answer.aclose()
+
+
+async def timed(models: list[str], hedge_after: float | None, base_url: str) -> list[float]:
+    client = AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+    return [await first_token_time(client, models, hedge_after) for _ in range(REQUESTS)]
+
+
+async def chat_times(base_url: str, pooled: bool) -> list[float]:
+    """first question of each chat, from the creation of its client, read to the end like the chat does"""
+    times = []
+    for _ in range(CHATS):
+        start = time.perf_counter()
+        if pooled:
+            client = shared_client(base_url, "stub")
+        else:  # OpenRouterChat before the shared pool
+            client = AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+        first = None
+        async for _ in race(client, MODELS[:1], [{"role": "user", "content": "hi"}], timeout=30):
+            first = first or time.perf_counter() - start
+        times.append(first)
+        if not pooled:
+            await client.close()  # left to the garbage collector by the app
+    return times
+
+
+async def compare_clients(tls: ssl.SSLContext) -> None:
+    for rtt in RTTS:
+        for label, pooled in [("before", False), ("after", True)]:
+            server = serve(stalls=False, rtt=rtt, tls=tls)
+            times = await chat_times(server.base_url, pooled)
+            label = f"{label} {rtt * 1e3:.0f} ms"
+            print(f"{label:14} {percentiles(times)} {server.connections:>7}")
+            server.shutdown()
+
+
+async def conversation_times(base_url: str, compact: bool) -> list[tuple[int, float]]:
+    """prompt tokens and time to first token of each turn"""
+    client = shared_client(base_url, "stub")
+    messages = [{"role": "developer", "content": "chart data " * 1200}]
+    turns = []
+    for turn in range(TURNS):
+        messages.append({"role": "user", "content": f"what does aspect {turn} mean for me?"})
+        sent = compact_history(messages, AI_HISTORY_TOKENS) if compact else list(messages)
+        tokens = sum(count_tokens(message["content"]) for message in sent)
+        start = time.perf_counter()
+        answer = race(client, MODELS[:1], sent, timeout=30)
+        try:
+            await anext(answer)
+            turns.append((tokens, time.perf_counter() - start))
+        finally:
+            await answer.aclose()
+        messages.append({"role": "assistant", "content": "word " * 500})
+    return turns
+
+
+async def compare_histories() -> None:
+    server = serve(stalls=False, prefill=PREFILL)
+    for label, compact in [("before", False), ("after", True)]:
+        turns = await conversation_times(server.base_url, compact)
+        for turn in [1, 10, 20, 30]:
+            tokens, ttft = turns[turn - 1]
+            print(f"{label + ' ' + str(turn):14} {tokens:>7} {ttft * 1e3:>7.0f}")
+
+
+class Busy:
+    """script threads busy at once, and their total busy time"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.now = self.peak = 0
+        self.seconds = 0.0
+
+    def run(self, func, *args):
+        with self.lock:
+            self.now += 1
+            self.peak = max(self.peak, self.now)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.now -= 1
+                self.seconds += time.perf_counter() - start
+
+
+def write_stream(client: AsyncOpenAI) -> str:
+    """answer consumed in the script thread, like st.write_stream did"""
+    answer = race(client, MODELS[:1], [{"role": "user", "content": "hi"}], timeout=30)
+
+    async def step():
+        return await anext(answer, None)
+
+    text = ""
+    while (item := asyncio.run_coroutine_threadsafe(step(), event_loop()).result()) is not None:
+        text += item[1]
+    return text
+
+
+def compare_sessions() -> None:
+    server = serve(stalls=False, token_delay=TOKEN_DELAY)
+    client = shared_client(server.base_url, "stub")
+    for label, background in [("before", False), ("after", True)]:
+        busy = Busy()
+        start = time.perf_counter()
+        if background:
+            messages = [{"role": "user", "content": "hi"}]
+            replies = [busy.run(stream, race(client, MODELS[:1], messages, timeout=30)) for _ in range(SESSIONS)]
+            with ThreadPoolExecutor(8) as script_threads:
+                while not all(reply.done for reply in replies):
+                    time.sleep(AI_POLL_INTERVAL)
+                    # each session renders its buffer
+                    list(script_threads.map(lambda reply: busy.run(lambda: reply.text), replies))
+            answers = [reply.text for reply in replies]
+        else:
+            with ThreadPoolExecutor(SESSIONS) as script_threads:
+                answers = list(script_threads.map(lambda _: busy.run(write_stream, client), range(SESSIONS)))
+        assert answers == ["the stars say hi"] * SESSIONS
+        wall = time.perf_counter() - start
+        print(f"{label:14} {wall:>7.1f} {busy.peak:>7} {busy.seconds / SESSIONS * 1e3:>9.2f}")
+
+
+def percentiles(times: list[float]) -> str:
+    times = sorted(times)
+    p50, p95 = statistics.median(times), times[int(len(times) * 0.95) - 1]
+    return f"{p50 * 1e3:>7.1f} {p95 * 1e3:>7.1f} {times[-1] * 1e3:>7.1f}"
+
+
+def main() -> None:
+    base_url = serve().base_url
+    print(f"{'models':14} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7}")
+    for label, models, hedge_after in [("before", MODELS[:1], None), ("after", MODELS, HEDGE_AFTER)]:
+        print(f"{label:14} {percentiles(submit(timed(models, hedge_after, base_url)).result())}")
+    print(f"\n{'clients, rtt':14} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'conns':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        submit(compare_clients(tls_context(directory))).result()
+
+    print(f"\n{'history, turn':14} {'tokens':>7} {'ttft ms':>7}")
+    submit(compare_histories()).result()
+
+    print(f"\n{'sessions':14} {'wall s':>7} {'threads':>7} {'thread ms':>9}")
+    compare_sessions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""CPU per rerun for a synastry chart: a Stats / AIContext per consumer (before) vs the shared ChartAnalysis (after).
+
+a rerun builds the stats panel grids; a chart change also builds the AI context, and printing the PDF report grids
+"""
+
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from analysis import analysis_cache, chart_analysis
+from natal import Data, Stats
+from natal.ai import AIContext
+from natal.data import DotDict
+
+RERUNS = 50
+DATA1 = Data(name="a", lat=22.3, lon=114.2, utc_dt=datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc))
+DATA2 = Data(name="b", lat=25.0, lon=121.5, utc_dt=datetime(1980, 8, 1, 3, 15, tzinfo=timezone.utc))
+SESS = DotDict(city1="Hong Kong", tz1="Asia/Hong_Kong", city2="Taipei", tz2="Asia/Taipei")
+PLACES = dict(city1=SESS.city1, tz1=SESS.tz1, city2=SESS.city2, tz2=SESS.tz2)
+
+
+def stats_panel(stats: Stats) -> None:
+    """grids of utils.stats_html"""
+    stats.basic_info()
+    stats.elements_vs_modalities()
+    stats.quadrants_vs_hemispheres()
+    stats.celestial_bodies(1)
+    stats.celestial_bodies(2)
+    stats.signs()
+    stats.houses()
+    stats.aspect_grid()
+
+
+def pdf_report(stats: Stats) -> None:
+    """grids of utils.pdf_html"""
+    stats.basic_info()
+    stats.elements_vs_modalities(pdf=True)
+    stats.quadrants_vs_hemispheres(pdf=True)
+    stats.celestial_bodies(1, pdf=True)
+    stats.celestial_bodies(2, pdf=True)
+    stats.aspect_grid(pdf=True)
+    stats.signs(pdf=True)
+    stats.houses(pdf=True)
+    stats.orb_settings()
+
+
+def ai_context(ai: AIContext) -> None:
+    """grids of ai.AI.__post_init__"""
+    for grid in [ai.celestial_bodies(1), ai.celestial_bodies(2), ai.signs(), ai.houses(), ai.aspects()]:
+        ai.markdown("", grid)
+    for grid in [ai.elements(), ai.modalities(), ai.polarities(), ai.quadrants()]:
+        ai.markdown("", grid)
+
+
+def before(first: bool) -> None:
+    stats_panel(Stats(data1=DATA1, data2=DATA2, **PLACES))
+    if first:
+        ai_context(AIContext(data1=DATA1, data2=DATA2, **PLACES))
+        pdf_report(Stats(data1=DATA1, data2=DATA2, **PLACES))
+
+
+def after(first: bool) -> None:
+    analysis = chart_analysis(DATA1, DATA2, SESS)
+    stats_panel(analysis)
+    if first:
+        ai_context(analysis)
+        pdf_report(analysis)
+
+
+def timed(rerun, first: bool) -> list[float]:
+    times = []
+    for _ in range(RERUNS):
+        if first:
+            analysis_cache().clear()
+        start = time.process_time()
+        rerun(first)
+        times.append(time.process_time() - start)
+    return times
+
+
+def main() -> None:
+    print(f"{'':21} {'mean ms':>8} {'min ms':>8}")
+    for first, label in [(True, "chart change"), (False, "rerun")]:
+        for name, rerun in [("before", before), ("after", after)]:
+            times = timed(rerun, first)
+            print(f"{label + ' ' + name:21} {statistics.mean(times) * 1e3:>8.2f} {min(times) * 1e3:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Saves per second with N concurrent savers: one shared connection committing per save vs db.Database."""
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database
+
+SCHEMA = "CREATE TABLE charts (data TEXT, hash TEXT, chart_type TEXT, email TEXT)"
+SAVES = 200
+DATA = "{" + "x" * 2000 + "}"  # about the size of an archived chart
+
+
+def run(savers: int, save) -> tuple[float, int]:
+    """saves per second and failed saves"""
+    errors = []
+
+    def saver(n: int):
+        for i in range(SAVES):
+            try:
+                save((DATA, f"{n}-{i}", "birth_page", f"user{n}"))
+            except Exception as e:  # the shared connection also raises SystemError under contention
+                errors.append(e)
+
+    threads = [threading.Thread(target=saver, args=(n,)) for n in range(savers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return savers * SAVES / (time.perf_counter() - start), len(errors)
+
+
+def shared_connection(path: Path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(SCHEMA)
+
+    def save(values):
+        conn.cursor().execute("INSERT INTO charts VALUES (?, ?, ?, ?)", values)
+        conn.commit()
+
+    return save, conn.close
+
+
+def database(path: Path):
+    db = Database(path)
+    db.execute(SCHEMA)
+    return lambda values: db.execute("INSERT INTO charts VALUES (?, ?, ?, ?)", values), db.close
+
+
+def main() -> None:
+    print(f"{'savers':>6} {'shared conn/s':>14} {'errors':>7} {'Database/s':>11} {'errors':>7}")
+    for savers in [1, 4, 16, 64]:
+        row = [f"{savers:>6}"]
+        for setup, width in [(shared_connection, 14), (database, 11)]:
+            with tempfile.TemporaryDirectory() as tmp:
+                save, close = setup(Path(tmp) / "data.db")
+                rate, errors = run(savers, save)
+                close()
+            row += [f"{rate:>{width}.0f}", f"{errors:>7}"]
+        print(" ".join(row))
+
+
+if __name__ == "__main__":
+    main()
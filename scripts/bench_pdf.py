@@ -0,0 +1,61 @@
+"""Per-report PDF latency: fonts and inline stylesheet loaded per report (cold) vs a reused PdfRenderer (warm)."""
+
+import statistics
+import sys
+import tagit
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from natal import Chart, Data, Stats
+from pdf import PDF_CSS, PdfRenderer
+from tagit import div, style, table, td, tr
+from weasyprint import HTML
+from weasyprint.text.fonts import FontConfiguration
+
+REPORTS = 10
+
+
+def report_html() -> str:
+    """a report with the chart and the bodies / aspects tables, like utils.pdf_html"""
+    data = Data(name="AstroMate 星盤", lat=22.3, lon=114.2, utc_dt="1976-04-20 10:00")
+    stats = Stats(data1=data)
+
+    def section(title: str, grid: list) -> str:
+        rows = [tr([td(cell) for cell in row]) for row in grid]
+        return div(div(title, class_="title") + table(rows), class_="section")
+
+    row1 = div(section("body", stats.celestial_bodies(pdf=True)), class_="info_col")
+    row1 += div(Chart(data, width=400).svg, class_="chart")
+    row2 = section("aspects", stats.aspect_grid(pdf=True))
+    return tagit.main(div(row1, class_="row1") + div(row2, class_="row2"))
+
+
+def cold_render(html: str) -> bytes:
+    """per-report rendering before the renderer: new font configuration, stylesheet parsed from the report"""
+    html = style(PDF_CSS.read_text()) + html
+    return HTML(string=html).write_pdf(font_config=FontConfiguration())
+
+
+def main() -> None:
+    html = report_html()
+    start = time.perf_counter()
+    renderer = PdfRenderer()
+    setup = time.perf_counter() - start
+    # interleaved, so neither side gets the warmed-up process or a quieter machine
+    times = {cold_render: [], renderer.render: []}
+    for _ in range(REPORTS):
+        for render, runs in times.items():
+            start = time.perf_counter()
+            render(html)
+            runs.append(time.perf_counter() - start)
+    print(f"renderer setup, once per worker: {setup * 1e3:.0f} ms")
+    print(f"{'':5} {'mean ms':>8} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for label, runs in zip(["cold", "warm"], times.values()):
+        stats = [statistics.mean(runs), statistics.median(runs), min(runs), max(runs)]
+        print(f"{label:5} {stats[0] * 1e3:>8.0f} {stats[1] * 1e3:>10.0f} {stats[2] * 1e3:>8.0f} {stats[3] * 1e3:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""CPU to build the AI system prompt when returning to a chart: rendered again (before) vs the prompt cache (after).
+
+"cold" also computes the chart analysis, as for a chart no panel has shown yet
+"""
+
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ai import prompt_cache, sys_prompt
+from analysis import analysis_cache
+from natal import Data
+from natal.data import DotDict
+
+RUNS = 50
+DATA1 = Data(name="a", lat=22.3, lon=114.2, utc_dt=datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc))
+DATA2 = Data(name="b", lat=25.0, lon=121.5, utc_dt=datetime(1980, 8, 1, 3, 15, tzinfo=timezone.utc))
+SESS = DotDict(city1="Hong Kong", tz1="Asia/Hong_Kong", city2="Taipei", tz2="Asia/Taipei", chart_type="synastry_page")
+
+
+def timed(clear: list) -> list[float]:
+    times = []
+    for _ in range(RUNS):
+        for cache in clear:
+            cache.clear()
+        start = time.process_time()
+        sys_prompt(DATA1, DATA2, 0, SESS)
+        times.append(time.process_time() - start)
+    return times
+
+
+def main() -> None:
+    print(f"{'':8} {'mean ms':>8} {'min ms':>8}")
+    for label, clear in [
+        ("cold", [analysis_cache(), prompt_cache()]),
+        ("before", [prompt_cache()]),
+        ("after", []),
+    ]:
+        times = timed(clear)
+        print(f"{label:8} {statistics.mean(times) * 1e3:>8.3f} {min(times) * 1e3:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
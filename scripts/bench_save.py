@@ -0,0 +1,67 @@
+"""Save latency of a chart: separate SELECT then UPDATE / INSERT vs one upsert statement."""
+
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database
+from scripts.migrate_unique_chart_hash import migrate
+
+SCHEMA = "CREATE TABLE charts (data TEXT, hash TEXT, chart_type TEXT, email TEXT)"
+SAVES = 2000
+CHARTS = 200  # distinct charts, so 1 in 10 saves creates and the rest overwrite
+DATA = "{" + "x" * 2000 + "}"  # about the size of an archived chart
+UPSERT = """INSERT INTO charts (data, hash, chart_type, email) VALUES (?, ?, ?, ?)
+    ON CONFLICT (email, hash) DO UPDATE SET data = excluded.data, revision = revision + 1
+    RETURNING revision"""
+
+
+def select_then_write(db: Database, hash: str) -> str:
+    """save_chart before: SELECT on a reader, then UPDATE or INSERT on the writer"""
+    if db.fetchone("SELECT 1 FROM charts WHERE email = ? AND hash = ?", ("a@b.c", hash)):
+        db.execute("UPDATE charts SET data = ? WHERE hash = ? and chart_type = ?", (DATA, hash, "birth_page"))
+        return "overwrite"
+    sql = "INSERT INTO charts (data, hash, chart_type, email) VALUES (?, ?, ?, ?)"
+    db.execute(sql, (DATA, hash, "birth_page", "a@b.c"))
+    return "create"
+
+
+def upsert(db: Database, hash: str) -> str:
+    """save_chart after"""
+    values = (DATA, hash, "birth_page", "a@b.c")
+    [(revision,)] = db.transact(lambda conn: conn.execute(UPSERT, values).fetchall())
+    return "create" if revision == 1 else "overwrite"
+
+
+def bench(save) -> list[float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "data.db"
+        conn = sqlite3.connect(path)
+        conn.execute(SCHEMA)
+        migrate(conn)
+        conn.close()
+        db = Database(path)
+        times = []
+        for n in range(SAVES):
+            start = time.perf_counter()
+            save(db, f"chart{n % CHARTS}")
+            times.append(time.perf_counter() - start)
+        db.close()
+    return times
+
+
+def main() -> None:
+    print(f"{'':18} {'mean µs':>8} {'p50 µs':>8} {'p99 µs':>8}")
+    for label, save in [("select then write", select_then_write), ("upsert", upsert)]:
+        times = sorted(bench(save))
+        mean, p50, p99 = statistics.mean(times), times[len(times) // 2], times[int(len(times) * 0.99)]
+        print(f"{label:18} {mean * 1e6:>8.0f} {p50 * 1e6:>8.0f} {p99 * 1e6:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
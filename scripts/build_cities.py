@@ -0,0 +1,20 @@
+"""Compile cities.csv into the memory-mapped dataset in CITIES_BIN_DIR (cities_bin/ by default).
+
+The Docker image runs this at build time. The app only compiles on start if the dataset is missing or stale.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cities import BIN_DIR, CSV_PATH, compile_cities, load_cities
+
+
+def main() -> None:
+    compile_cities(CSV_PATH, BIN_DIR)
+    print(f"{len(load_cities())} cities compiled to {BIN_DIR}")
+
+
+if __name__ == "__main__":
+    main()
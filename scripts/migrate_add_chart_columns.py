@@ -0,0 +1,50 @@
+"""Add indexed name / datetime columns to the charts table in data.db. Idempotent; safe to run multiple times.
+
+The columns are virtual generated columns over the JSON in `data`, so existing and future rows are covered
+without touching the code that writes charts.
+"""
+
+import sqlite3
+from pathlib import Path
+
+DB_PATH = Path(__file__).resolve().parent.parent / "data.db"
+
+COLUMNS = ["name1", "name2", "dt1", "dt2"]
+INDEXES = {
+    # saved names and chart by name, newest first
+    "idx_charts_name": "charts (email, chart_type, name1, updated_at)",
+    # saved charts table, newest first
+    "idx_charts_recent": "charts (email, chart_type, updated_at)",
+}
+
+
+def migrate(conn: sqlite3.Connection) -> list[str]:
+    """add missing columns and indexes, return what was added"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_xinfo(charts)")}
+    added = []
+    for col in COLUMNS:
+        if col not in existing:
+            expr = f"json_extract(data, '$.{col}')"
+            conn.execute(f"ALTER TABLE charts ADD COLUMN {col} TEXT GENERATED ALWAYS AS ({expr}) VIRTUAL")
+            added.append(col)
+    for name, target in INDEXES.items():
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone():
+            conn.execute(f"CREATE INDEX {name} ON {target}")
+            added.append(name)
+    conn.commit()
+    return added
+
+
+def main() -> None:
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if added := migrate(conn):
+            print("Migration applied:", ", ".join(added))
+        else:
+            print("Columns and indexes already exist, skip.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Make (email, hash) unique in the charts table of data.db, for single statement upserts. Idempotent; safe to run
+multiple times.
+
+- duplicate (email, hash) rows left by concurrent saves are removed, the newest one is kept
+- a `revision` column counts saves of a chart, 1 means the save created it
+"""
+
+import sqlite3
+from pathlib import Path
+
+DB_PATH = Path(__file__).resolve().parent.parent / "data.db"
+
+
+def migrate(conn: sqlite3.Connection) -> list[str]:
+    """apply missing changes, return what was done"""
+    done = []
+    cursor = conn.execute(
+        """DELETE FROM charts WHERE rowid NOT IN (SELECT max(rowid) FROM charts GROUP BY email, hash)"""
+    )
+    if cursor.rowcount:
+        done.append(f"{cursor.rowcount} duplicates removed")
+    if "revision" not in {row[1] for row in conn.execute("PRAGMA table_xinfo(charts)")}:
+        conn.execute("ALTER TABLE charts ADD COLUMN revision INTEGER NOT NULL DEFAULT 1")
+        done.append("revision")
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_charts_hash'").fetchone():
+        conn.execute("CREATE UNIQUE INDEX uq_charts_hash ON charts (email, hash)")
+        done.append("uq_charts_hash")
+    conn.commit()
+    return done
+
+
+def main() -> None:
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if done := migrate(conn):
+            print("Migration applied:", ", ".join(done))
+        else:
+            print("Unique index already exists, skip.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
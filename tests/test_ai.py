@@ -0,0 +1,58 @@
+import asyncio
+from ai import answer_key, normalize, prewarm, prompt_cache, sys_prompt
+from cache import DiskCache
+from datetime import datetime, timezone
+from natal import Data
+from natal.data import DotDict
+from tests.test_llm import FakeClient
+
+DATA1 = Data(name="a", lat=22.3, lon=114.2, utc_dt=datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc))
+DATA2 = Data(name="b", lat=25.0, lon=121.5, utc_dt=datetime(1980, 8, 1, 3, 15, tzinfo=timezone.utc))
+SESS = DotDict(city1="Hong Kong", tz1="Asia/Hong_Kong", city2="Taipei", tz2="Asia/Taipei", chart_type="synastry_page")
+
+
+def test_sys_prompt():
+    prompt = sys_prompt(DATA1, DATA2, 0, SESS)
+    assert "Synastry" in prompt
+    assert "Please reply in English." in prompt
+    assert "Aspects between a and b" in prompt
+
+
+def test_sys_prompt_cached_per_chart_and_language():
+    prompt_cache().clear()
+    prompt = sys_prompt(DATA1, DATA2, 0, SESS)
+    assert sys_prompt(DATA1, DATA2, 0, SESS) is prompt
+    assert "Traditional Chinese" in sys_prompt(DATA1, DATA2, 1, SESS)
+    assert "Birth" in sys_prompt(DATA1, None, 0, DotDict(**{**vars(SESS), "chart_type": "birth_page"}))
+    assert len(prompt_cache()) == 3
+
+
+def test_normalize():
+    assert normalize("  What is my Sun sign?") == normalize("what is my sun sign")
+    assert normalize("我的太陽星座是什麼？") == "我的太陽星座是什麼"
+
+
+def test_answer_key():
+    key = answer_key("chart", "What is my Sun sign?", "model", 0)
+    assert answer_key("chart", "what is my sun sign", "model", 0) == key
+    assert answer_key("other chart", "What is my Sun sign?", "model", 0) != key
+    assert answer_key("chart", "What is my Sun sign?", "model", 1) != key
+
+
+def test_prewarm(tmp_path):
+    client = FakeClient({"a": (0, ["sun ", "in taurus"]), "b": (0, ["no"])})
+    cache = DiskCache("test_ai_answers", tmp_path, max_bytes=1024**2)
+    cache.set(answer_key("chart", "q2", "a", 0), b"known")
+    asyncio.run(prewarm(client, "chart", ["q1", "q2"], ["a", "b"], 0, cache))
+    assert cache.get(answer_key("chart", "q1", "a", 0)) == b"sun in taurus"
+    assert client.asked == ["a"]
+
+
+def test_prewarm_fallback(tmp_path):
+    client = FakeClient({"a": RuntimeError("Error code: 429"), "b": (0, ["sun"])})
+    cache = DiskCache("test_ai_fallback", tmp_path, max_bytes=1024**2)
+    asyncio.run(prewarm(client, "chart", ["q1"], ["a", "b"], 0, cache))
+    assert cache.get(answer_key("chart", "q1", "b", 0)) == b"sun"
+    client.asked.clear()
+    asyncio.run(prewarm(client, "chart", ["q1"], ["a", "b"], 0, cache))
+    assert client.asked == []
@@ -0,0 +1,47 @@
+from analysis import analysis_cache, chart_analysis
+from datetime import datetime, timezone
+from natal import Data, Stats
+from natal.ai import AIContext
+from natal.data import DotDict
+
+DATA1 = Data(name="a", lat=22.3, lon=114.2, utc_dt=datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc))
+DATA2 = Data(name="b", lat=25.0, lon=121.5, utc_dt=datetime(1980, 8, 1, 3, 15, tzinfo=timezone.utc))
+SESS = DotDict(city1="Hong Kong", tz1="Asia/Hong_Kong", city2="Taipei", tz2="Asia/Taipei")
+
+
+def test_same_grids_as_natal():
+    analysis = chart_analysis(DATA1, DATA2, SESS)
+    stats = Stats(data1=DATA1, data2=DATA2, city1="Hong Kong", tz1="Asia/Hong_Kong", city2="Taipei", tz2="Asia/Taipei")
+    context = AIContext(
+        data1=DATA1, data2=DATA2, city1="Hong Kong", tz1="Asia/Hong_Kong", city2="Taipei", tz2="Asia/Taipei"
+    )
+    as_lists = lambda grid: [list(row) for row in grid]  # noqa: E731
+    assert analysis.basic_info(["n", "c", "xy", "t"]) == as_lists(stats.basic_info(["n", "c", "xy", "t"]))
+    assert list(zip(*analysis.basic_info())) == context.basic_info()
+    assert analysis.houses(pdf=True) == stats.houses(pdf=True)
+    assert analysis.aspect_grid(total_label="∑") == stats.aspect_grid(total_label="∑")
+    assert analysis.aspects() == context.aspects()
+    assert analysis.elements() == context.elements()
+
+
+def test_shared_per_chart():
+    analysis_cache().clear()
+    analysis = chart_analysis(DATA1, None, SESS)
+    assert chart_analysis(DATA1, None, SESS) is analysis
+    assert chart_analysis(DATA1, DATA2, SESS) is not analysis
+    assert chart_analysis(DATA1, None, DotDict(**{**vars(SESS), "city1": "Kowloon"})) is not analysis
+    assert len(analysis_cache()) == 3
+
+
+def test_grids_computed_once():
+    analysis = chart_analysis(DATA1, DATA2, SESS)
+    grid = analysis.signs(headers=["s", "1", "2", "sum"])
+    assert analysis.signs(headers=["s", "1", "2", "sum"]) == grid
+    assert analysis.aspect_pairs() is analysis.aspect_pairs()
+    assert len([key for key in analysis._memo if key[0] == "signs"]) == 1
+
+
+def test_copies_survive_markdown():
+    analysis = chart_analysis(DATA1, None, SESS)
+    analysis.markdown("bodies", analysis.celestial_bodies())
+    assert analysis.celestial_bodies()[0] == ["body", "sign", "house", "dignity"]
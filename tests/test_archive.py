@@ -0,0 +1,59 @@
+import archive
+import pytest
+import sqlite3
+import threading
+from archive import update_setting, user_settings
+from const import GENERAL_OPTS
+from db import Database
+from utils import settings_cache
+
+EMAIL = "a@b.c"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / "data.db")
+    conn.execute(f"CREATE TABLE users (email TEXT PRIMARY KEY, {', '.join(GENERAL_OPTS)})")
+    conn.execute(f"INSERT INTO users VALUES (?, {', '.join('?' * len(GENERAL_OPTS))})", [EMAIL, *GENERAL_OPTS.values()])
+    conn.commit()
+    conn.close()
+    db = Database(tmp_path / "data.db", pool_size=2, batch_size=8)
+    monkeypatch.setattr(archive, "data_db", lambda: db)
+    settings_cache().clear()
+    yield db
+    db.close()
+
+
+def saved(db: Database, key: str):
+    return db.fetchone(f"SELECT {key} FROM users WHERE email = ?", (EMAIL,))[0]
+
+
+def test_user_settings_read_once(db: Database):
+    version, settings = user_settings(EMAIL)
+    assert settings == GENERAL_OPTS
+    db.execute("UPDATE users SET pdf_color = 'dark'")
+    assert user_settings(EMAIL) == (version, settings)
+
+
+def test_update_setting_writes_through(db: Database):
+    version, _ = user_settings(EMAIL)
+    new_version = update_setting(EMAIL, "pdf_color", "dark")
+    assert new_version > version
+    assert user_settings(EMAIL) == (new_version, GENERAL_OPTS | {"pdf_color": "dark"})
+    db.flush()
+    assert saved(db, "pdf_color") == "dark"
+
+
+def test_reload_waits_for_queued_updates(db: Database):
+    user_settings(EMAIL)
+    # hold the writer, so the update is still queued when the entry is evicted and reloaded
+    release = threading.Event()
+    db.submit(lambda conn: release.wait())
+    update_setting(EMAIL, "pdf_color", "dark")
+    settings_cache().clear()
+    reloaded = []
+    reader = threading.Thread(target=lambda: reloaded.append(user_settings(EMAIL)))
+    reader.start()
+    release.set()
+    reader.join()
+    assert reloaded[0][1]["pdf_color"] == "dark"
@@ -0,0 +1,56 @@
+import time
+from cache import DiskCache, LRUCache, metrics
+
+
+def test_lru_eviction():
+    cache = LRUCache("test_lru", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl():
+    cache = LRUCache("test_ttl", ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_get_or_set_counters():
+    cache = LRUCache("test_counters")
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_set("a", lambda: calls.append(1) or "svg") == "svg"
+    assert len(calls) == 1
+    assert metrics()["test_counters"] == cache.stats()
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_cache_eviction(tmp_path):
+    cache = DiskCache("test_disk", tmp_path, max_bytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.set("c", b"12345")
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.stats()["bytes"] == 10
+    assert cache.stats()["bytes_saved"] == 5
+    assert cache.stats()["hit_rate"] == 0.5
+
+    # entries survive a restart
+    assert DiskCache("test_disk", tmp_path, max_bytes=10).get("c") == b"12345"
+
+
+def test_disk_cache_ttl(tmp_path):
+    cache = DiskCache("test_disk_ttl", tmp_path, max_bytes=100, ttl=0.01)
+    cache.set("a", b"1")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
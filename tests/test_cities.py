@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from cities import KEEP_VERSIONS, CityIndex, compile_cities, load_cities
+from pytest import fixture
+
+
+@fixture(scope="module")
+def index():
+    df = pd.read_csv("cities.csv")
+    return CityIndex.build(df["city"], df["lat"], df["lon"], df["tz"], df["pop"])
+
+
+def test_get(index: CityIndex):
+    assert index.get("Hong Kong - HK") == (22.2783, 114.175, "Asia/Hong_Kong")
+    assert index.get("Atlantis") is None
+
+
+def test_search_prefix(index: CityIndex):
+    assert index.search("hong")[0] == "Hong Kong - HK"
+    assert index.search("  TAIPEI ")[0] == "Taipei - TW"
+    assert "Hong Kong - HK" in index.search("kong")
+
+
+def test_search_substring(index: CityIndex):
+    results = index.search("aipe")
+    assert "Taipei - TW" in results
+    assert all("aipe" in name.casefold() for name in results)
+
+
+def test_search_empty(index: CityIndex):
+    assert index.search("", limit=5) == index.popular(5)
+    assert index.search("zzzz") == []
+
+
+def test_nearest(index: CityIndex):
+    assert index.nearest(22.2783, 114.175) == "Hong Kong - HK"
+    assert index.nearest(25.0531, 121.526) == "Taipei - TW"
+    assert index.nearest(25.06, 121.52) == "Taipei - TW"
+
+
+def test_compiled_dataset(index: CityIndex, tmp_path):
+    compiled = load_cities(bin_dir=tmp_path / "cities_bin")
+    assert (tmp_path / "cities_bin" / "source.md5").exists()
+    assert compiled.arrays.keys() == index.arrays.keys()
+    for name, array in compiled.arrays.items():
+        assert isinstance(array.base, np.memmap), name  # shared pages, not a per-process copy
+        assert np.array_equal(array, index.arrays[name]), name
+    assert compiled.timezones == index.timezones
+    assert compiled.get("Taipei - TW") == index.get("Taipei - TW")
+    assert compiled.search("hong", limit=5) == index.search("hong", limit=5)
+
+
+def test_recompile_swaps_version(tmp_path):
+    bin_dir = tmp_path / "cities_bin"
+    bin_dir.mkdir()  # compiled before versioning
+    compile_cities(bin_dir=bin_dir)
+    first = bin_dir.resolve()
+    compile_cities(bin_dir=bin_dir)
+    assert bin_dir.is_symlink()
+    assert bin_dir.resolve() != first
+    assert first.exists()  # kept for readers that resolved it already
+    compile_cities(bin_dir=bin_dir)
+    assert not first.exists()
+    assert len(list(tmp_path.iterdir())) == 1 + KEEP_VERSIONS
+    assert load_cities(bin_dir=bin_dir).get("Taipei - TW")
+
+
+def test_load_skips_compiled(tmp_path):
+    bin_dir = tmp_path / "cities_bin"
+    compile_cities(bin_dir=bin_dir)
+    version = bin_dir.resolve()
+    load_cities(bin_dir=bin_dir)
+    assert bin_dir.resolve() == version
+    (version / "source.md5").write_text("other csv")
+    load_cities(bin_dir=bin_dir)
+    assert bin_dir.resolve() != version
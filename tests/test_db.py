@@ -0,0 +1,112 @@
+import pytest
+import sqlite3
+import threading
+from db import Database
+from scripts import migrate_add_chart_columns, migrate_unique_chart_hash
+
+SAVERS = 16
+SAVES = 50
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(tmp_path / "data.db", pool_size=4, batch_size=32)
+    db.execute("CREATE TABLE charts (data TEXT, hash TEXT, chart_type TEXT, email TEXT)")
+    yield db
+    db.close()
+
+
+def test_wal(db: Database):
+    assert db.fetchone("PRAGMA journal_mode") == ("wal",)
+
+
+def test_readers_are_read_only(db: Database):
+    with pytest.raises(sqlite3.OperationalError):
+        db.fetchone("INSERT INTO charts VALUES ('{}', 'h', 'birth_page', 'a@b.c')")
+
+
+def test_failed_write_keeps_batch(db: Database):
+    futures = [
+        db.submit(lambda conn: conn.execute("INSERT INTO charts VALUES ('{}', 'a', 'birth_page', 'a@b.c')")),
+        db.submit(lambda conn: conn.execute("INSERT INTO missing VALUES (1)")),
+        db.submit(lambda conn: conn.execute("INSERT INTO charts VALUES ('{}', 'b', 'birth_page', 'a@b.c')")),
+    ]
+    with pytest.raises(sqlite3.OperationalError):
+        futures[1].result()
+    futures[2].result()
+    assert db.fetchall("SELECT hash FROM charts ORDER BY hash") == [("a",), ("b",)]
+
+
+def test_concurrent_savers(db: Database):
+    """SAVERS threads saving and reading back at once, no lost writes and no 'database is locked'"""
+    errors = []
+
+    def saver(n: int):
+        try:
+            for i in range(SAVES):
+                sql = "INSERT INTO charts VALUES (?, ?, 'birth_page', ?)"
+                db.execute(sql, ("{}", f"{n}-{i}", f"user{n}"))
+                assert db.fetchone("SELECT 1 FROM charts WHERE hash = ?", (f"{n}-{i}",))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=saver, args=(n,)) for n in range(SAVERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert db.fetchone("SELECT count(*) FROM charts") == (SAVERS * SAVES,)
+    assert db.stats()["writes"] == SAVERS * SAVES + 1
+    # concurrent writes share commits
+    assert db.stats()["commits"] < db.stats()["writes"]
+
+
+def test_chart_columns_migration(tmp_path):
+    conn = sqlite3.connect(tmp_path / "data.db")
+    conn.execute(
+        "CREATE TABLE charts (data TEXT, hash TEXT, chart_type TEXT, email TEXT, "
+        "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    rows = [('{"name1": "Ann", "dt1": "2000-01-01T13:00:00"}', "a", f"2025-01-0{n}") for n in range(1, 4)]
+    conn.executemany("INSERT INTO charts VALUES (?, ?, 'birth_page', 'a@b.c', ?)", rows)
+    assert migrate_add_chart_columns.migrate(conn) == [
+        "name1",
+        "name2",
+        "dt1",
+        "dt2",
+        "idx_charts_name",
+        "idx_charts_recent",
+    ]
+    assert migrate_add_chart_columns.migrate(conn) == []
+    assert conn.execute("SELECT name1, dt1, name2 FROM charts LIMIT 1").fetchone() == (
+        "Ann",
+        "2000-01-01T13:00:00",
+        None,
+    )
+
+    sql = """SELECT data FROM charts WHERE email = ? AND chart_type = 'birth_page' AND name1 = ?
+        ORDER BY updated_at DESC LIMIT 1"""
+    plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, ("a@b.c", "Ann")))
+    assert "USING INDEX idx_charts_name" in plan
+    assert "TEMP B-TREE" not in plan
+    conn.close()
+
+
+def test_upsert_migration(tmp_path):
+    conn = sqlite3.connect(tmp_path / "data.db")
+    conn.execute("CREATE TABLE charts (data TEXT, hash TEXT, chart_type TEXT, email TEXT)")
+    conn.executemany("INSERT INTO charts VALUES (?, 'h', 'birth_page', 'a@b.c')", [("old",), ("new",)])
+    assert migrate_unique_chart_hash.migrate(conn) == ["1 duplicates removed", "revision", "uq_charts_hash"]
+    assert migrate_unique_chart_hash.migrate(conn) == []
+    assert conn.execute("SELECT data, revision FROM charts").fetchall() == [("new", 1)]
+
+    sql = """INSERT INTO charts (data, hash, chart_type, email) VALUES (?, ?, 'birth_page', ?)
+        ON CONFLICT (email, hash) DO UPDATE SET data = excluded.data, revision = revision + 1
+        RETURNING revision"""
+    assert conn.execute(sql, ("x", "h2", "a@b.c")).fetchall() == [(1,)]
+    assert conn.execute(sql, ("y", "h2", "a@b.c")).fetchall() == [(2,)]
+    assert conn.execute(sql, ("z", "h2", "other@b.c")).fetchall() == [(1,)]
+    assert conn.execute("SELECT data FROM charts WHERE hash = 'h2' AND email = 'a@b.c'").fetchall() == [("y",)]
+    conn.close()
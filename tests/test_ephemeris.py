@@ -0,0 +1,42 @@
+from datetime import date, datetime, timedelta, timezone
+from ephemeris import data_cache, shared_data, solar_return_cache, solar_return_dt
+from natal import Config
+
+UTC_DT = datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc)
+
+
+def test_shared_data_reused():
+    data_cache().clear()
+    data1 = shared_data("a", 22.3, 114.2, UTC_DT, Config())
+    data2 = shared_data("b", 22.3, 114.2, UTC_DT, Config())
+    assert data1.planets is data2.planets
+    assert (data1.name, data2.name) == ("a", "b")
+    assert len(data_cache()) == 1
+
+
+def test_shared_data_config_isolated():
+    data1 = shared_data("a", 22.3, 114.2, UTC_DT, Config())
+    data1.config.theme_type = "mono"
+    data2 = shared_data("a", 22.3, 114.2, UTC_DT, Config())
+    assert data2.config.theme_type == "dark"
+
+
+def test_shared_data_keyed_by_config():
+    data1 = shared_data("a", 22.3, 114.2, UTC_DT, Config(house_sys="W"))
+    data2 = shared_data("a", 22.3, 114.2, UTC_DT, Config(house_sys="P"))
+    assert data1.houses is not data2.houses
+
+
+def test_solar_return_dt():
+    data = shared_data("a", 22.3, 114.2, UTC_DT, Config())
+    expected = data.solar_return(target_yr=2030).utc_dt
+    assert abs(solar_return_dt(data, 2030) - expected) < timedelta(minutes=1)
+    # neighbouring years come from the same batch
+    hits = solar_return_cache().hits
+    solar_return_dt(data, 2031)
+    assert solar_return_cache().hits == hits + 1
+
+
+def test_solar_return_leap_day():
+    data = shared_data("a", 22.3, 114.2, datetime(2000, 2, 29, 12, tzinfo=timezone.utc), Config())
+    assert solar_return_dt(data, 2001).date() in (date(2001, 2, 28), date(2001, 3, 1))
@@ -0,0 +1,183 @@
+import asyncio
+import httpx
+import pytest
+import time
+from llm import DrainOnClose, compact_history, count_tokens, race, shared_client, stream
+from openai import AuthenticationError
+from types import SimpleNamespace
+
+
+class FakeStream:
+    def __init__(self, delay: float, tokens: list[str]) -> None:
+        self.delay = delay
+        self.tokens = tokens
+        self.closed = False
+        # one iterator, resumed by every `async for` like openai.AsyncStream
+        self.chunks = self.generate()
+
+    async def generate(self):
+        await asyncio.sleep(self.delay)
+        for token in self.tokens:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def __aiter__(self):
+        return self.chunks
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class FakeClient:
+    """chat.completions.create of AsyncOpenAI, replying per model with (first token delay, tokens) or an error"""
+
+    def __init__(self, replies: dict) -> None:
+        self.replies = replies
+        self.asked = []
+        self.streams = {}
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, model: str, messages: list, stream: bool) -> FakeStream:
+        self.asked.append(model)
+        if isinstance(reply := self.replies[model], Exception):
+            raise reply
+        self.streams[model] = FakeStream(*reply)
+        return self.streams[model]
+
+
+def answer(client: FakeClient, models: list[str], timeout: float = 1, hedge_after: float | None = None) -> list:
+    async def collect():
+        return [item async for item in race(client, models, [], timeout, hedge_after)]
+
+    return asyncio.run(collect())
+
+
+def test_first_model_answers():
+    client = FakeClient({"a": (0, ["he", "llo"]), "b": (0, ["no"])})
+    assert answer(client, ["a", "b"]) == [("a", "he"), ("a", "llo")]
+    assert client.asked == ["a"]
+    assert client.streams["a"].closed
+
+
+def test_failover_on_error():
+    client = FakeClient({"a": RuntimeError("Error code: 429"), "b": (0, ["hi"])})
+    assert answer(client, ["a", "b"]) == [("b", "hi")]
+
+
+def test_failover_on_timeout():
+    client = FakeClient({"a": (10, ["late"]), "b": (0, ["hi"])})
+    assert answer(client, ["a", "b"], timeout=0.05) == [("b", "hi")]
+    assert client.streams["a"].closed
+
+
+def test_hedged_request():
+    client = FakeClient({"a": (0.5, ["slow"]), "b": (0, ["fast"]), "c": (0, ["unused"])})
+    assert answer(client, ["a", "b", "c"], hedge_after=0.05) == [("b", "fast")]
+    assert client.asked == ["a", "b"]
+    assert client.streams["a"].closed
+
+
+def test_all_models_fail():
+    client = FakeClient({"a": RuntimeError("a"), "b": RuntimeError("b")})
+    with pytest.raises(RuntimeError, match="b"):
+        answer(client, ["a", "b"])
+
+
+def test_fatal_error_stops():
+    response = httpx.Response(401, request=httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions"))
+    client = FakeClient({"a": AuthenticationError("invalid key", response=response, body=None), "b": (0, ["hi"])})
+    with pytest.raises(AuthenticationError):
+        answer(client, ["a", "b"])
+    assert client.asked == ["a"]
+
+
+def test_stream_in_background():
+    client = FakeClient({"a": (0, ["x", "y", "z"])})
+    reply = stream(race(client, ["a"], [], 1))
+    reply.future.result(timeout=1)
+    assert (reply.text, reply.model, reply.error, reply.done) == ("xyz", "a", None, True)
+    assert client.streams["a"].closed
+
+
+def test_stream_error():
+    reply = stream(race(FakeClient({"a": RuntimeError("Error code: 429")}), ["a"], [], 1))
+    reply.future.result(timeout=1)
+    assert str(reply.error) == "Error code: 429" and reply.done
+
+
+def test_stream_cancelled():
+    # eg. the chat of a chart that was changed
+    client = FakeClient({"a": (10, ["late"])})
+    reply = stream(race(client, ["a"], [], 30))
+    while "a" not in client.streams:
+        time.sleep(0.01)
+    reply.cancel()
+    while not reply.done:
+        time.sleep(0.01)
+    assert client.streams["a"].closed
+    assert reply.text == ""
+
+
+def test_shared_client():
+    client = shared_client("https://openrouter.ai/api/v1", "key1")
+    assert shared_client("https://openrouter.ai/api/v1", "key1") is client
+    other = shared_client("https://openrouter.ai/api/v1", "key2")
+    assert other is not client
+    assert other._client is client._client
+
+
+def test_drain_on_close():
+    class Body(httpx.AsyncByteStream):
+        def __init__(self) -> None:
+            self.read = []
+            self.closed = False
+
+        async def __aiter__(self):
+            for chunk in [b"data: hi", b"data: [DONE]", b""]:
+                self.read.append(chunk)
+                yield chunk
+
+        async def aclose(self) -> None:
+            self.closed = True
+
+    async def stop_at_first_chunk():
+        body = Body()
+        stream = DrainOnClose(body)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        return body
+
+    body = asyncio.run(stop_at_first_chunk())
+    assert body.read == [b"data: hi", b"data: [DONE]", b""]
+    assert body.closed
+
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+    assert count_tokens("the sun in taurus") == 4
+    assert count_tokens("personality") == 2
+    assert count_tokens("2024 ♉ 太陽") == 5
+
+
+def conversation(turns: int, answer: str = "word " * 100) -> list[dict]:
+    messages = [{"role": "developer", "content": "chart"}]
+    for turn in range(turns):
+        messages += [{"role": "user", "content": f"question {turn}"}, {"role": "assistant", "content": answer}]
+    return messages + [{"role": "user", "content": "new question"}]
+
+
+def test_history_within_budget():
+    messages = conversation(3)
+    assert compact_history(messages, 1000) == messages
+
+
+def test_history_over_budget():
+    messages = conversation(30)
+    compacted = compact_history(messages, 250)
+    assert compacted[0] == messages[0]
+    assert compacted[1]["role"] == "developer"
+    assert "- question 27" in compacted[1]["content"] and "- question 17" not in compacted[1]["content"]
+    # the last 2 turns and the new question
+    assert compacted[2:] == messages[-5:]
+    # the new question is sent even when over budget
+    assert compact_history(messages, 0)[-1] == messages[-1]
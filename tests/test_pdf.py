@@ -0,0 +1,97 @@
+import pytest
+import threading
+import time
+from pdf import PdfQueue, PdfRenderer, QueueFull
+
+HTML = "<main><div class='section'><div class='title'>Report 星盤</div></div></main>"
+
+
+@pytest.fixture(scope="module")
+def queue():
+    return PdfQueue(workers=1, max_jobs=2)
+
+
+def wait(queue: PdfQueue, job_id: str, timeout: float = 60) -> str:
+    end = time.monotonic() + timeout
+    while (status := queue.status(job_id)) in ("queued", "running") and time.monotonic() < end:
+        time.sleep(0.05)
+    return status
+
+
+def test_renderer():
+    renderer = PdfRenderer()
+    assert renderer.render(HTML).startswith(b"%PDF")
+    assert renderer.render(HTML).startswith(b"%PDF")
+
+
+def test_queue(queue: PdfQueue):
+    job_id = queue.submit(HTML)
+    assert wait(queue, job_id) == "done"
+    assert queue.result(job_id).startswith(b"%PDF")
+    assert queue.ahead(job_id) == 0
+    queue.discard(job_id)
+    assert queue.status(job_id) == "unknown"
+
+
+def test_queue_depth(queue: PdfQueue, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(queue, "_render", lambda html: release.wait() and b"%PDF")
+    jobs = [queue.submit(HTML), queue.submit(HTML)]
+    with pytest.raises(QueueFull):
+        queue.submit(HTML)
+    assert queue.ahead(jobs[1]) == 1
+    release.set()
+    for job_id in jobs:
+        assert wait(queue, job_id) == "done"
+    queue.submit(HTML)
+
+
+def test_render_many(queue: PdfQueue):
+    htmls = (HTML.replace("Report", f"Report {n}") for n in range(5))
+    pdfs = [future.result() for future in queue.render_many(htmls, window=2)]
+    assert len(pdfs) == 5
+    assert all(pdf.startswith(b"%PDF") for pdf in pdfs)
+
+
+def test_render_many_cached(queue: PdfQueue):
+    futures = queue.render_many([HTML, b"%PDF cached", HTML], window=2)
+    assert [future.result()[:11] for future in futures][1] == b"%PDF cached"
+
+
+def test_dead_worker_replaced(queue: PdfQueue):
+    worker = queue._idle.queue[0]
+    worker.proc.kill()
+    worker.proc.wait()
+    assert wait(queue, queue.submit(HTML)) == "failed"
+    job_id = queue.submit(HTML)
+    assert wait(queue, job_id) == "done"
+    assert queue.result(job_id).startswith(b"%PDF")
+
+
+def test_prints_before_exports(queue: PdfQueue, monkeypatch):
+    release, order = threading.Event(), []
+    monkeypatch.setattr(queue, "_render", lambda html: release.wait() and order.append(html) or b"%PDF")
+    first = queue.submit("print 1")
+    while queue.status(first) != "running":
+        time.sleep(0.01)
+    exports = queue.render_many(["export 1", "export 2"], window=3)
+    futures = [next(exports)]
+    job_id = queue.submit("print 2")
+    release.set()
+    futures += list(exports)
+    assert [future.result() for future in futures] == [b"%PDF", b"%PDF"]
+    assert wait(queue, job_id) == "done"
+    assert order == ["print 1", "print 2", "export 1", "export 2"]
+
+
+def test_render_many_closed_early(queue: PdfQueue, monkeypatch):
+    release, rendered = threading.Event(), []
+    monkeypatch.setattr(queue, "_render", lambda html: release.wait() and rendered.append(html) or b"%PDF")
+    futures = queue.render_many([f"report {n}" for n in range(4)], window=3)
+    first = next(futures)
+    futures.close()
+    release.set()
+    assert first.result() == b"%PDF"
+    # exports run in order, so anything left of the first one would render before this
+    assert next(queue.render_many(["last"], window=1)).result() == b"%PDF"
+    assert rendered == ["report 0", "last"]
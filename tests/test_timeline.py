@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+from natal import Config, Data, Stats
+from natal.config import Display
+from pytest import fixture
+from timeline import Timeline, exact_aspects, shift, wrap
+from zoneinfo import ZoneInfo
+
+TZ = "Asia/Hong_Kong"
+
+
+@fixture(scope="module")
+def natal():
+    utc_dt = datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc)
+    return Data(name="sample", lat=22.3, lon=114.2, utc_dt=utc_dt, config=Config())
+
+
+def transit_at(local_dt: datetime, display: Display = Display()) -> Data:
+    utc_dt = local_dt.replace(tzinfo=ZoneInfo(TZ)).astimezone(timezone.utc)
+    return Data(name="transit", lat=25.0, lon=121.5, utc_dt=utc_dt, config=Config(display=display))
+
+
+def test_shift():
+    assert shift(datetime(2024, 1, 31), "month", 1) == datetime(2024, 2, 29)
+    assert shift(datetime(2024, 2, 29), "year", -1) == datetime(2023, 2, 28)
+    assert shift(datetime(2024, 12, 15), "month", 2) == datetime(2025, 2, 15)
+    assert shift(datetime(2024, 1, 1), "minute", -1) == datetime(2023, 12, 31, 23, 59)
+
+
+def test_timeline_matches_data(natal: Data):
+    display = Display(chiron=True, south_node=True, mc=True)
+    anchor = datetime(2014, 4, 15, 18, 48)
+    timeline = Timeline.build(natal, transit_at(anchor, display), TZ, anchor, "week", 2)
+    assert len(timeline.local_dts) == 5
+
+    local_dt = shift(anchor, "week", 1)
+    idx = timeline.index_of(local_dt)
+    transit = transit_at(local_dt, display)
+    assert [b.name for b in timeline.bodies] == [b.name for b in transit.aspectables]
+    for lon, body in zip(timeline.lons[idx], transit.aspectables):
+        assert abs(lon - body.degree) < 1e-6
+
+    expected = {(a.body1.name, a.body2.name, a.aspect_member.name) for a in Stats(natal, data2=transit).aspect_pairs()}
+    found = {(a.transit_body.name, a.natal_body.name, a.aspect_member.name) for a in timeline.aspects_at(idx)}
+    assert found == expected
+
+
+def test_month_end_anchors(natal: Data):
+    anchor = datetime(2024, 3, 31, 12)
+    timeline = Timeline.build(natal, transit_at(anchor), TZ, anchor, "month", 30)
+    assert len(timeline.local_dts) == 61
+    assert timeline.index_of(anchor) == 30
+    assert timeline.index_of(datetime(2024, 2, 29, 12)) == 29
+    assert timeline.index_of(datetime(2024, 5, 31, 12)) == 32
+
+    anchor = datetime(2024, 2, 29, 12)
+    timeline = Timeline.build(natal, transit_at(anchor), TZ, anchor, "year", 30)
+    assert timeline.index_of(anchor) == 30
+    assert timeline.index_of(datetime(2028, 2, 29, 12)) == 34
+    assert timeline.index_of(datetime(2025, 2, 28, 12)) == 31
+
+
+def test_batch_center(natal: Data):
+    # a later batch is still shifted from the anchor, not from the clamped step it is centered on
+    anchor = datetime(2024, 1, 31, 12)
+    timeline = Timeline.build(natal, transit_at(anchor), TZ, anchor, "month", 2, center=3)
+    assert timeline.offsets == range(1, 6)
+    assert timeline.local_dts[0] == datetime(2024, 2, 29, 12)
+    assert timeline.local_dts[2] == datetime(2024, 4, 30, 12)
+    assert timeline.local_dts[4] == datetime(2024, 6, 30, 12)
+    assert timeline.index_of(datetime(2024, 3, 31, 12)) == 1
+
+
+def test_exact_aspects(natal: Data):
+    start = datetime(2014, 4, 1, tzinfo=timezone.utc)
+    end = datetime(2014, 5, 1, tzinfo=timezone.utc)
+    events = exact_aspects(natal, transit_at(datetime(2014, 4, 1)), start, end)
+    assert events == sorted(events, key=lambda e: e.utc_dt)
+    assert all(start <= e.utc_dt <= end for e in events)
+    # the Moon aspects every natal body within a month
+    assert {e.natal_body.name for e in events if e.transit_body.name == "moon"} == {b.name for b in natal.aspectables}
+    for event in events:
+        transit = Data(name="transit", lat=25.0, lon=121.5, utc_dt=event.utc_dt)
+        separation = abs(wrap(transit[event.transit_body.name].degree - event.natal_body.degree))
+        assert abs(separation - event.aspect_member.value) < 0.02
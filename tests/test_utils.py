@@ -0,0 +1,133 @@
+import json
+import pandas as pd
+import pytest
+import sqlite3
+import utils
+from archive import chart_hash
+from const import SAVED_CHARTS_PAGE_SIZE
+from datetime import date, datetime, timezone
+from db import Database
+from natal import Chart, Data
+from natal.config import Display
+from natal.const import ASPECT_NAMES
+from natal.data import DotDict
+from scripts import migrate_add_chart_columns
+from utils import ages, chart_svg, charts_count, charts_df, charts_filter, saved_charts_cache, svg_cache, touch_charts
+
+EMAIL = "a@b.c"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / "data.db")
+    conn.execute(
+        "CREATE TABLE charts (data TEXT, hash TEXT, chart_type TEXT, email TEXT, "
+        "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    migrate_add_chart_columns.migrate(conn)
+    conn.close()
+    db = Database(tmp_path / "data.db", pool_size=2, batch_size=8)
+    monkeypatch.setattr(utils, "data_db", lambda: db)
+    saved_charts_cache().clear()
+    yield db
+    db.close()
+
+
+def save(db: Database, n: int, name1: str, city1: str = "Taipei") -> None:
+    data = {
+        "name1": name1,
+        "name2": "",
+        "city1": city1,
+        "dt1": "2000-01-01T13:00:00",
+        "dt2": "2000-01-01T13:00:00",
+        "solar_return_year": 2025,
+    }
+    sql = "INSERT INTO charts VALUES (?, ?, 'birth_page', ?, ?)"
+    db.execute(sql, (json.dumps(data), f"h{n}", EMAIL, f"2025-01-01 00:00:{n:02d}"))
+
+
+def names(query: str) -> list[str]:
+    where, params = charts_filter(EMAIL, "birth_page", query)
+    return sorted(name for (name,) in utils.data_db().fetchall(f"SELECT name1 FROM charts WHERE {where}", params))
+
+
+def test_charts_filter_escapes_like(db: Database):
+    for n, name in enumerate(["100% Ann", "1000 Ann", "a_b", "axb", "back\\slash", "backxslash"]):
+        save(db, n, name)
+    assert names("%") == ["100% Ann"]
+    assert names("_") == ["a_b"]
+    assert names("\\") == ["back\\slash"]
+    assert names(" ann ") == ["100% Ann", "1000 Ann"]
+    assert len(names("")) == 6
+
+
+def test_charts_filter_matches_city(db: Database):
+    save(db, 0, "Ann", city1="Hong Kong")
+    save(db, 1, "Bob")
+    assert names("hong") == ["Ann"]
+
+
+def test_ages():
+    born = pd.Timestamp.now(tz="UTC").tz_localize(None).normalize() - pd.DateOffset(years=30)
+    dts = pd.Series([born - pd.Timedelta(days=1), born + pd.Timedelta(days=1)]).dt.strftime("%Y-%m-%dT%H:%M:%S")
+    assert ages(dts).tolist() == ["30", "29"]
+
+
+def test_charts_pages(db: Database):
+    total = SAVED_CHARTS_PAGE_SIZE + 5
+    for n in range(total):
+        save(db, n, f"name {n}")
+    assert charts_count(EMAIL, "birth_page") == total
+    page1 = charts_df(EMAIL, "birth_page")
+    page2 = charts_df(EMAIL, "birth_page", page=2)
+    assert len(page1) == SAVED_CHARTS_PAGE_SIZE
+    assert len(page2) == 5
+    assert page1["name1"].iloc[0] == f"name {total - 1}"  # newest first
+    assert page2["name1"].iloc[-1] == "name 0"
+    assert charts_df(EMAIL, "birth_page", page=3) is None
+    assert page1["delete"].iloc[0] == f"?delete=h{total - 1}&chart_type=birth_page"
+    assert page1["age1"].iloc[0].isdigit()
+
+
+def test_touch_charts_invalidates(db: Database):
+    save(db, 0, "Ann")
+    assert charts_count(EMAIL, "birth_page") == 1
+    assert len(charts_df(EMAIL, "birth_page")) == 1
+    save(db, 1, "Bob")
+    assert charts_count(EMAIL, "birth_page") == 1
+    touch_charts(EMAIL)
+    assert charts_count(EMAIL, "birth_page") == 2
+    assert len(charts_df(EMAIL, "birth_page")) == 2
+    assert charts_count("other@b.c", "birth_page") == 0
+
+
+def chart_sess(**changes) -> DotDict:
+    """chart inputs of both charts, as in the session state"""
+    sess = {"chart_type": "birth_page", "solar_return_year": 2025, "house_sys": "Placidus"}
+    sess |= {aspect: 6 for aspect in ASPECT_NAMES}
+    for i in "12":
+        sess |= {f"name{i}": "a", f"city{i}": "Hong Kong", f"tz{i}": "Asia/Hong_Kong"}
+        sess |= {f"lat{i}": 22.3, f"lon{i}": 114.2, f"date{i}": date(1976, 4, 20), f"hr{i}": 18, f"min{i}": 58}
+        sess |= {f"{body}{i}": True for body in Display.model_fields}
+    return DotDict(**(sess | changes))
+
+
+def test_chart_svg_cache(monkeypatch):
+    renders = []
+    monkeypatch.setattr(utils, "Chart", lambda *args, **kwargs: renders.append(args) or Chart(*args, **kwargs))
+    svg_cache().clear()
+    data = Data(name="a", lat=22.3, lon=114.2, utc_dt=datetime(1976, 4, 20, 10, 58, tzinfo=timezone.utc))
+
+    def svg(theme: str = "dark", size: int = 400, **changes) -> str:
+        return chart_svg(chart_hash(theme, size, sess=chart_sess(**changes)), data, None, size)
+
+    first = svg()
+    assert svg() is first
+    assert len(renders) == 1
+    assert svg(theme="light") is not first
+    assert svg(size=500) != first
+    assert svg(sun1=False) is not first
+    assert svg(conjunction=8) is not first
+    assert svg(house_sys="Whole Sign") is not first
+    assert len(renders) == 6
+    assert svg() is first
@@ -0,0 +1,240 @@
+"""transit positions and aspects for every step of a date range, computed in one batch"""
+
+import numpy as np
+import swisseph as swe
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+from natal import Data
+from natal.classes import Body
+from natal.const import ASPECT_MEMBERS, EXTRA_MEMBERS, PLANET_MEMBERS, VERTEX_MEMBERS, VERTEX_NAMES
+from typing import Literal
+from zoneinfo import ZoneInfo
+
+type StepUnit = Literal["year", "month", "week", "day", "hour", "minute"]
+
+
+def shift(dt: datetime, unit: StepUnit, n: int) -> datetime:
+    """move a datetime by n units, clamping the day for month and year steps (eg. Jan 31 -> Feb 28)"""
+    match unit:
+        case "year" | "month":
+            months = dt.month - 1 + n * (12 if unit == "year" else 1)
+            year, month = dt.year + months // 12, months % 12 + 1
+            day = min(dt.day, monthrange(year, month)[1])
+            return dt.replace(year=year, month=month, day=day)
+        case "week":
+            return dt + timedelta(weeks=n)
+        case "day":
+            return dt + timedelta(days=n)
+        case "hour":
+            return dt + timedelta(hours=n)
+        case "minute":
+            return dt + timedelta(minutes=n)
+
+
+def julian_day(utc: datetime) -> float:
+    """same precision as natal.Data.julian_day"""
+    return swe.julday(utc.year, utc.month, utc.day, utc.hour + utc.minute / 60)
+
+
+def utc_of_julian_day(jd: float) -> datetime:
+    """UTC datetime of a julian day, rounded to the minute"""
+    dt = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(days=jd - 2440587.5)
+    return (dt + timedelta(seconds=30)).replace(second=0, microsecond=0)
+
+
+def wrap(degree: float | np.ndarray) -> float | np.ndarray:
+    """wrap angle differences into [-180, 180)"""
+    return (degree + 180) % 360 - 180
+
+
+def motion(jd: float, body: Body) -> tuple[float, float]:
+    """ecliptic longitude and speed (degree per day) of a planet or extra body"""
+    if body.value == -10:  # south node
+        (lon, _, _, speed, *_), _ = swe.calc_ut(jd, 10)
+        return (lon + 180) % 360, speed
+    (lon, _, _, speed, *_), _ = swe.calc_ut(jd, body.value)
+    return lon, speed
+
+
+def longitude(jd: float, body: Body) -> float:
+    """ecliptic longitude of a planet or extra body"""
+    return motion(jd, body)[0]
+
+
+def transit_bodies(transit: Data) -> list[Body]:
+    """displayed bodies of the transit chart, in the order of natal.Data.aspectables"""
+    display = transit.config.display
+    return [m for m in PLANET_MEMBERS + EXTRA_MEMBERS + VERTEX_MEMBERS if display[m.name]]
+
+
+def positions(jd: float, bodies: list[Body], lat: float, lon: float, house_sys: str) -> list[float]:
+    """ecliptic longitudes of bodies at a julian day"""
+    _, (asc, mc, *_) = swe.houses(jd, lat, lon, house_sys.encode())
+    vertices = {"asc": asc, "ic": (mc + 180) % 360, "dsc": (asc + 180) % 360, "mc": mc}
+    output = []
+    for body in bodies:
+        output.append(vertices[body.name] if body.name in vertices else longitude(jd, body))
+    return output
+
+
+@dataclass(frozen=True)
+class AspectEvent:
+    utc_dt: datetime
+    transit_body: Body
+    natal_body: Body
+    aspect_member: Body
+
+
+@dataclass(frozen=True)
+class TransitAspect:
+    transit_body: Body
+    natal_body: Body
+    aspect_member: Body
+    orb: float
+
+
+@dataclass
+class Timeline:
+    """transit longitudes against a natal chart, one row per step"""
+
+    local_dts: list[datetime]
+    offsets: range  # steps of each row from the anchor
+    bodies: list[Body]
+    lons: np.ndarray  # (steps, transit bodies)
+    natal_bodies: list[Body]
+    natal_lons: np.ndarray  # (natal bodies,)
+    orbs: dict[str, int]
+
+    @classmethod
+    def build(
+        cls,
+        natal: Data,
+        transit: Data,
+        tz: str,
+        anchor: datetime,
+        unit: StepUnit,
+        steps: int,
+        center: int = 0,
+    ) -> "Timeline":
+        """positions of transit bodies `steps` steps on each side of the step `center` from anchor (naive local
+        datetimes in tz)
+
+        every step is shifted from the anchor, so a month end or leap day anchor stays on the timeline
+        """
+        offsets = range(center - steps, center + steps + 1)
+        local_dts = [shift(anchor, unit, n) for n in offsets]
+
+        zone, utc = ZoneInfo(tz), ZoneInfo("UTC")
+        bodies = transit_bodies(transit)
+        rows = []
+        for dt in local_dts:
+            jd = julian_day(dt.replace(tzinfo=zone).astimezone(utc))
+            rows.append(positions(jd, bodies, transit.lat, transit.lon, transit.house_sys))
+        lons = np.array(rows).reshape(len(local_dts), len(bodies))
+        return cls(
+            local_dts=local_dts,
+            offsets=offsets,
+            bodies=bodies,
+            lons=lons,
+            natal_bodies=natal.aspectables,
+            natal_lons=np.array([b.degree for b in natal.aspectables]),
+            orbs=natal.config.orb.model_dump(),
+        )
+
+    @cached_property
+    def steps(self) -> dict[datetime, int]:
+        return {dt: idx for idx, dt in enumerate(self.local_dts)}
+
+    def index_of(self, dt: datetime) -> int | None:
+        """step index of a naive local datetime, None if it is not on the timeline"""
+        return self.steps.get(dt)
+
+    @cached_property
+    def separations(self) -> np.ndarray:
+        """angular separation (0-180) of every transit vs natal body, shape (steps, transit, natal)"""
+        diff = self.lons[:, :, None] - self.natal_lons[None, None, :]
+        return np.abs((diff + 180) % 360 - 180)
+
+    def aspects_at(self, idx: int) -> list[TransitAspect]:
+        """transit to natal aspects within orb at a step"""
+        sep = self.separations[idx]
+        output = []
+        for member in ASPECT_MEMBERS:
+            if not (orb := self.orbs[member.name]):
+                continue
+            offset = np.abs(sep - member.value)
+            for t, n in zip(*np.nonzero(offset <= orb)):
+                output.append(TransitAspect(self.bodies[t], self.natal_bodies[n], member, float(offset[t, n])))
+        return output
+
+
+# sampling interval in days, short enough that a body can't form the same exact aspect twice in one interval
+SAMPLE_DAYS = {"moon": 0.5, "sun": 1, "mercury": 1, "venus": 1, "mars": 1}
+SLOW_SAMPLE_DAYS = 8
+
+
+def refine(body: Body, target: float, lo: float, hi: float, gap_lo: float, gap_hi: float, precision: float) -> float:
+    """julian day in [lo, hi] where the body is at target longitude
+
+    Newton steps with the body speed from a linear first guess, bisection whenever a step leaves the bracket
+    """
+    jd = lo + (hi - lo) * gap_lo / (gap_lo - gap_hi)
+    while hi - lo > precision:
+        lon, speed = motion(jd, body)
+        gap = wrap(lon - target)
+        if (gap < 0) == (gap_lo < 0):
+            lo, gap_lo = jd, gap
+        else:
+            hi = jd
+        nxt = jd - gap / speed if speed else lo
+        if not lo < nxt < hi:
+            nxt = (lo + hi) / 2
+        if abs(nxt - jd) < precision:
+            return nxt
+        jd = nxt
+    return (lo + hi) / 2
+
+
+def exact_aspects(
+    natal: Data,
+    transit: Data,
+    start: datetime,
+    end: datetime,
+    precision_days: float = 1 / 1440,
+) -> list[AspectEvent]:
+    """UTC datetimes when displayed transit bodies form an exact aspect to natal bodies
+
+    each body is sampled every SAMPLE_DAYS, sign changes of the signed distance to every aspect angle are
+    found in one vectorized pass per body, then each root is refined with `refine`.
+    transit vertices are skipped, they circle the chart daily.
+    """
+    bodies = [b for b in transit_bodies(transit) if b.name not in VERTEX_NAMES]
+    natal_bodies = natal.aspectables
+    # both sides of the circle for aspects other than conjunction and opposition
+    targets = [
+        (member, sign * member.value)
+        for member in ASPECT_MEMBERS
+        if natal.config.orb[member.name]
+        for sign in ((1,) if member.value in (0, 180) else (1, -1))
+    ]
+    if not (bodies and natal_bodies and targets):
+        return []
+
+    jd_start, jd_end = julian_day(start), julian_day(end)
+    # target longitudes, shape (natal, targets)
+    target_lons = np.array([b.degree for b in natal_bodies])[:, None] + np.array([angle for _, angle in targets])
+    events = []
+    for body in bodies:
+        sample_days = SAMPLE_DAYS.get(body.name, SLOW_SAMPLE_DAYS)
+        jds = np.append(np.arange(jd_start, jd_end, sample_days), jd_end)
+        lons = np.array([longitude(jd, body) for jd in jds])
+        # signed distance to exactness, shape (samples, natal, targets)
+        gap = wrap(lons[:, None, None] - target_lons[None, :, :])
+        # a root is a change of sign that is not the jump at +-180
+        crossed = ((gap[:-1] < 0) != (gap[1:] < 0)) & (np.abs(gap[:-1] - gap[1:]) < 90)
+        for s, n, k in zip(*np.nonzero(crossed)):
+            jd = refine(body, target_lons[n, k], jds[s], jds[s + 1], gap[s, n, k], gap[s + 1, n, k], precision_days)
+            events.append(AspectEvent(utc_of_julian_day(jd), body, natal_bodies[n], targets[k][0]))
+    return sorted(events, key=lambda e: e.utc_dt)
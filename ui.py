@@ -2,36 +2,65 @@ import pandas as pd
 import streamlit as st
 from ai import AI
 from archive import (
-    create_user,
+    chart_hash,
     data_hash,
-    fetch_user_record,
     load_chart,
     save_chart,
+    submit_export,
+    update_setting,
+    user_settings,
+)
+from const import (
+    CITY_OPTIONS,
+    DISPLAY,
+    MAX_CHART_SIZE,
+    ORBS,
+    PDF_COLOR,
+    PDF_POLL_INTERVAL,
+    ROW_HEIGHT,
+    SAVED_CHARTS_PAGE_SIZE,
+    SESS,
+    SYMBOLS,
 )
-from const import DISPLAY, GENERAL_OPTS, MAX_CHART_SIZE, ORBS, PDF_COLOR, ROW_HEIGHT, SESS, SYMBOLS
 from datetime import date as Date
 from datetime import datetime as Dt
-from natal import Chart, Data
+from natal import Data
 from natal.config import HouseSys
 from natal.const import ASPECT_NAMES, PLANET_NAMES
+from pdf import QueueFull
 from streamlit.column_config import DatetimeColumn, LinkColumn
+from tempfile import TemporaryFile
 from utils import (
+    PDF_VERSION,
     all_timezones,
+    aspect_events,
+    chart_svg,
+    charts_count,
     charts_df,
-    cities_df,
-    data_db,
+    charts_version,
+    city_index,
     debug_print,
     get_chart_by_name,
+    get_dt,
     get_saved_natal_names,
     i,
+    lang_num,
+    move_timeline,
+    pdf_cache,
+    pdf_filename,
     pdf_html,
-    pdf_io,
+    pdf_queue,
+    prewarm_timeline,
+    rerun_app_if_changed,
     reset_inputs,
     screenwidth_detector,
     stats_html,
     step,
+    timed_fragment,
+    transit_timeline,
     update_orbs,
 )
+from zoneinfo import ZoneInfo
 
 
 def segmented_ui():
@@ -55,41 +84,57 @@ def segmented_ui():
         )
 
 
+def page_state() -> str:
+    """everything the chart, stats and AI fragments are drawn from"""
+    return chart_hash(SESS.pdf_color, SESS.show_stats, SESS.enable_ai)
+
+
+def charts_state() -> int | None:
+    """version of the saved charts listed in the sidebar"""
+    return charts_version(st.user.email) if st.user.is_logged_in else None
+
+
+@timed_fragment("sidebar")
 def sidebar_ui():
+    """options and saved charts, call in `with st.sidebar`. searching or paging the charts reruns the sidebar alone"""
     # debug_print()
-    with st.sidebar:
-        with st.expander(i("options"), expanded=True):
-            labels = ["general", "orbs"]
-            match SESS.chart_type:
-                case "birth_page":
-                    labels.append("birth")
-                case "synastry_page":
-                    labels += ["birth", "synastry"]
-                case "transit_page":
-                    labels += ["birth", "transit"]
-                case "solar_return_page":
-                    labels.append("solar_return_page")
-            tabs = list(st.tabs([i(label) for label in labels]))
-            with tabs[0]:
-                general_opt()
-            with tabs[1]:
-                orb_opt()
-            with tabs[2]:
-                display_opt(1)
-            if len(labels) > 3:
-                with tabs[3]:
-                    display_opt(2)
+    # options changed by a callback, skip drawing the sidebar twice
+    rerun_app_if_changed("page_state", page_state())
+    SESS.charts_state = charts_state()
+    with st.expander(i("options"), expanded=True):
+        labels = ["general", "orbs"]
+        match SESS.chart_type:
+            case "birth_page":
+                labels.append("birth")
+            case "synastry_page":
+                labels += ["birth", "synastry"]
+            case "transit_page":
+                labels += ["birth", "transit"]
+            case "solar_return_page":
+                labels.append("solar_return_page")
+        tabs = list(st.tabs([i(label) for label in labels]))
+        with tabs[0]:
+            general_opt()
+        with tabs[1]:
+            orb_opt()
+        with tabs[2]:
+            display_opt(1)
+        if len(labels) > 3:
+            with tabs[3]:
+                display_opt(2)
 
-        if st.user.is_logged_in:
-            saved_charts_ui()
-            st.button(
-                i("logout"),
-                icon=":material/logout:",
-                width="stretch",
-                on_click=st.logout,
-            )
-        else:
-            st.button(i("login"), icon=":material/login:", width="stretch", on_click=st.login)
+    if st.user.is_logged_in:
+        saved_charts_ui()
+        st.button(
+            i("logout"),
+            icon=":material/logout:",
+            width="stretch",
+            on_click=st.logout,
+        )
+    else:
+        st.button(i("login"), icon=":material/login:", width="stretch", on_click=st.login)
+    # settings loaded from another tab, or a chart loaded from the table, change the rest of the page
+    rerun_app_if_changed("page_state", page_state())
 
 
 def general_opt():
@@ -98,20 +143,14 @@ def general_opt():
     # print("general_opt start:", datetime.now())
     def update_db(key: str):
         if st.user.is_logged_in:
-            sql = f"UPDATE users SET {key} = ? WHERE email = ?"
-            cursor = data_db().cursor()
-            cursor.execute(sql, (SESS[key], st.user.email))
-            data_db().commit()
+            SESS.settings_version = update_setting(st.user.email, key, SESS[key])
 
     if st.user.is_logged_in:
-        # get user options from db
-        if user_record := fetch_user_record(st.user.email):
-            # user found, set general options from db
-            for field in GENERAL_OPTS:
-                SESS[field] = user_record[field]
-        else:
-            # create user with default options
-            create_user([st.user.email] + [SESS[field] for field in GENERAL_OPTS])
+        # copy settings into the session on login, or when another tab changed them
+        version, settings = user_settings(st.user.email)
+        if SESS.settings_version != version:
+            SESS.update(settings)
+            SESS.settings_version = version
 
     st.selectbox(
         i("house_system"),
@@ -326,22 +365,28 @@ def input_ui(id: int):
 
     def city():
         city_num = f"city{id}"
-        df = cities_df()
+        matches_num = f"city_matches{id}"
+        index = city_index()
 
         def set_lat_lon_tz():
-            """set lat, lon, tz from a city index"""
-            if SESS.get(city_num) is None:
+            """set lat, lon, tz from the selected city, a typed name is resolved by searching all cities"""
+            name = SESS.get(city_num)
+            if name is None:
                 return
-            idx = df.index[df["city"] == SESS[city_num]][0]
-            columns = ["lat", "lon", "tz"]
-            row = df.iloc[idx][columns]
-            for prop in columns:
-                SESS[f"{prop}{id}"] = row[prop]
+            if index.get(name) is None:
+                SESS[matches_num] = index.search(name, limit=CITY_OPTIONS)
+                if not SESS[matches_num]:
+                    return
+                SESS[city_num] = name = SESS[matches_num][0]
+            for prop, val in zip(["lat", "lon", "tz"], index.get(name)):
+                SESS[f"{prop}{id}"] = val
 
         SESS[city_num] = SESS[city_num]  # prevent sess clean up
+        # only the current city, last search matches and the most populous cities are sent to the browser
+        options = [SESS[city_num], *SESS.get(matches_num, []), *index.popular(CITY_OPTIONS)]
         st.selectbox(
             i("city"),
-            options=df["city"],
+            options=[city for city in dict.fromkeys(options) if city],
             key=city_num,
             placeholder=i("city_placeholder"),
             accept_new_options=True,
@@ -352,6 +397,16 @@ def input_ui(id: int):
     def lat_lon_tz():
         c1, c2, c3 = st.columns(3)
         lat, lon, tz = f"lat{id}", f"lon{id}", f"tz{id}"
+
+        def set_nearest_city():
+            """label typed coordinates with the nearest city, and its timezone if none is set"""
+            if SESS[f"city{id}"] or SESS[lat] is None or SESS[lon] is None:
+                return
+            index = city_index()
+            SESS[f"city{id}"] = index.nearest(SESS[lat], SESS[lon])
+            if not SESS[tz]:
+                SESS[tz] = index.get(SESS[f"city{id}"])[2]
+
         for key in [lat, lon, tz]:
             # prevent sess clean up if widget is not drawn on screen
             SESS[key] = SESS[key]
@@ -363,6 +418,7 @@ def input_ui(id: int):
                 key=lat,
                 min_value=-max_lat,
                 max_value=max_lat,
+                on_change=set_nearest_city,
             )
         except Exception:
             st.error(i(SESS.house_sys) + i("latitude_error"))
@@ -373,6 +429,7 @@ def input_ui(id: int):
             key=lon,
             min_value=-179.99,
             max_value=179.99,
+            on_change=set_nearest_city,
         )
 
         c3.selectbox(
@@ -419,7 +476,15 @@ def input_ui(id: int):
     date_hr_min()
 
 
+def toast_later(body: str, icon: str) -> None:
+    """toast from a widget callback in a fragment, where elements can't be drawn. shown by `utils_ui`"""
+    SESS.toasts = [*SESS.toasts, (body, icon)]
+
+
 def utils_ui(data1: Data, data2: Data | None):
+    for body, icon in SESS.toasts:
+        st.toast(body, icon=icon)
+    SESS.toasts = []
     chart_id = 2 if data2 else 1
     st.write("")
     with st.container(
@@ -471,9 +536,10 @@ def utils_ui(data1: Data, data2: Data | None):
                 "",
                 icon=":material/save:",
                 key="save",
-                on_click=lambda: st.toast(i("chart_created"), icon=":material/check:")
-                if save_chart(st.user.email) == "create"
-                else st.toast(i("chart_updated"), icon=":material/check:"),
+                on_click=lambda: toast_later(
+                    i("chart_created") if save_chart(st.user.email) == "create" else i("chart_updated"),
+                    ":material/check:",
+                ),
                 help=i("save_chart"),
                 disabled=disable_save(),
             )
@@ -487,26 +553,142 @@ def utils_ui(data1: Data, data2: Data | None):
             )
 
         with st.container(width=50, key="print-container"):
-            with st.empty():
-                if st.button("", icon=":material/print:", key="pdf-button", help=i("gen_pdf")):
-                    with st.spinner("", width="stretch"):
-                        html = pdf_html(data1, data2)
-                        pdf = pdf_io(html)
-                    name_parts = [SESS.name1]
-                    if SESS.name2 and SESS.chart_type == "synastry_page":
-                        name_parts.append(SESS.name2)
-                    name_parts.append(i(SESS.chart_type))
-                    filename = "_".join(name_parts)
-                    st.download_button(
-                        "",
-                        icon=":material/download:",
-                        data=pdf,
-                        file_name=f"{filename}.pdf",
-                        mime="application/pdf",
-                        help=i("download_pdf"),
-                    )
+            pdf_ui(data1, data2)
+
+    if SESS.chart_type == "transit_page":
+        timeline_ui(data1, data2)
+        aspect_events_ui(data1, data2)
+
+
+def pdf_ui(data1: Data, data2: Data | None):
+    """print button, then progress of the background PDF job, then its download button"""
+    # everything pdf_html depends on
+    key = chart_hash("pdf", SESS.pdf_color, lang_num(), *PDF_VERSION)
+
+    def submit():
+        job = {"id": None, "key": key, "filename": pdf_filename(), "pdf": pdf_cache().get(key)}
+        if job["pdf"] is None:
+            try:
+                job["id"] = pdf_queue().submit(pdf_html(data1, data2))
+            except QueueFull:
+                toast_later(i("pdf_busy"), ":material/hourglass_disabled:")
+                return
+        SESS.pdf_job = job
+
+    def clear():
+        if SESS.pdf_job["id"]:
+            pdf_queue().discard(SESS.pdf_job["id"])
+        SESS.pdf_job = None
+
+    def progress(job_id: str):
+        if pdf_queue().status(job_id) not in ("queued", "running"):
+            st.rerun()
+        ahead = pdf_queue().ahead(job_id)
+        help = i("pdf_pending").format(ahead=ahead)
+        st.button("", icon=":material/hourglass_top:", key="pdf-pending", disabled=True, help=help)
+
+    if (job := SESS.pdf_job) and job["key"] != key:
+        # chart changed since the print click
+        clear()
+    elif job and job["pdf"] is None:
+        match pdf_queue().status(job["id"]):
+            case "queued" | "running":
+                st.fragment(progress, run_every=PDF_POLL_INTERVAL)(job["id"])
+                return
+            case "done":
+                job["pdf"] = pdf_queue().result(job["id"])
+                pdf_queue().discard(job["id"])
+                job["id"] = None
+                pdf_cache().set(key, job["pdf"])
+            case _:
+                st.toast(i("pdf_failed"), icon=":material/error:")
+                clear()
+
+    if job := SESS.pdf_job:
+        st.download_button(
+            "",
+            icon=":material/download:",
+            data=job["pdf"],
+            file_name=f"{job['filename']}.pdf",
+            mime="application/pdf",
+            help=i("download_pdf"),
+            on_click=clear,
+        )
+    else:
+        st.button("", icon=":material/print:", key="pdf-button", help=i("gen_pdf"), on_click=submit)
 
 
+def timeline_ui(data1: Data, data2: Data):
+    """scrub slider over a batch of transit steps, the charts next to the transit datetime are built ahead"""
+    timeline = transit_timeline(data1, data2)
+    dts = timeline.local_dts
+
+    def on_scrub():
+        move_timeline(timeline.offsets[SESS.scrub])
+
+    fmt = "%Y-%m-%d %H:%M" if SESS.stepper_unit in ["hour", "minute"] else "%Y-%m-%d"
+    SESS.scrub = timeline.index_of(get_dt(2))
+    if SESS.scrub is None:  # the transit datetime is always a step, but never index by None
+        return
+    st.select_slider(
+        i("timeline"),
+        options=range(len(dts)),
+        key="scrub",
+        format_func=lambda idx: dts[idx].strftime(fmt),
+        on_change=on_scrub,
+        label_visibility="collapsed",
+    )
+    # the chart key of `chart_ui`
+    prewarm_timeline(timeline, data1, lambda sess: chart_hash(data1.config.theme_type, SESS.chart_size, sess=sess))
+    aspects = sorted(timeline.aspects_at(SESS.scrub), key=lambda asp: asp.orb)
+    st.caption(
+        " · ".join(f"{asp.transit_body.symbol} {asp.aspect_member.symbol} {asp.natal_body.symbol}" for asp in aspects)
+    )
+
+
+def aspect_events_ui(data1: Data, data2: Data):
+    """exact transit aspects from the transit date, selecting one loads the transit chart at that moment"""
+
+    def on_select(data: pd.DataFrame):
+        selected = SESS.aspect_events.selection.rows
+        if selected:
+            dt = data.iloc[selected[0]]["local_time"]
+            SESS.date2 = dt.date()
+            SESS.hr2 = dt.hour
+            SESS.min2 = dt.minute
+
+    tz = ZoneInfo(SESS.tz2)
+    events = aspect_events(data1, data2)
+    data = pd.DataFrame(
+        [
+            {
+                "local_time": event.utc_dt.astimezone(tz).replace(tzinfo=None),
+                "transit": event.transit_body.symbol,
+                "aspect": event.aspect_member.symbol,
+                "birth": event.natal_body.symbol,
+            }
+            for event in events
+        ],
+        columns=["local_time", "transit", "aspect", "birth"],
+    )
+    with st.expander(i("exact_aspects")):
+        st.dataframe(
+            data,
+            hide_index=True,
+            column_config={
+                "local_time": DatetimeColumn(i("local_time"), format="YYYY-MM-DD HH:mm"),
+                "transit": i("transit"),
+                "aspect": i("aspect"),
+                "birth": i("birth"),
+            },
+            row_height=ROW_HEIGHT,
+            key="aspect_events",
+            selection_mode="single-row",
+            on_select=lambda d=data: on_select(d),
+        )
+
+
+@timed_fragment("stats")
 def stats_ui(data1: Data, data2: Data | None):
     if not SESS.show_stats:
         return
@@ -526,17 +708,22 @@ def chart_ui(data1: Data, data2: Data = None):
         key="screen_detector",
         on_width_change=update_chart_size,
     )
-    chart = Chart(data1=data1, data2=data2, width=SESS.chart_size)
+    key = chart_hash(data1.config.theme_type, SESS.chart_size)
+    svg = chart_svg(key, data1, data2, SESS.chart_size)
     with st.container(key="chart_svg"):
-        st.markdown(chart.svg, unsafe_allow_html=True)
+        st.markdown(svg, unsafe_allow_html=True)
     # check if chart data has changed
     if SESS["data_hash"] != data_hash():
         SESS["data_hash"] = data_hash()
         # reset chat history and ai questions
+        if SESS.ai:
+            SESS.ai.chat.cancel()
         SESS.ai = None
 
 
+@timed_fragment("ai")
 def ai_ui(data1: Data, data2: Data | None) -> None:
+    """chat, a message reruns this fragment alone"""
     if not SESS.enable_ai:
         return
     if SESS.ai is None:
@@ -553,7 +740,18 @@ def saved_charts_ui():
             load_chart(row.to_dict())
 
     st.subheader(i("saved_charts").format(chart_type=i(SESS.chart_type)))
-    data = charts_df()
+    st.text_input(
+        i("search_charts"),
+        key="charts_query",
+        icon=":material/search:",
+        label_visibility="collapsed",
+        placeholder=i("search_charts"),
+        on_change=lambda: SESS.update(charts_page=1),
+    )
+    total = charts_count(st.user.email, SESS.chart_type, SESS.charts_query)
+    pages = max(1, -(-total // SAVED_CHARTS_PAGE_SIZE))
+    SESS.charts_page = min(SESS.charts_page, pages)
+    data = charts_df(st.user.email, SESS.chart_type, SESS.charts_query, SESS.charts_page)
     if data is None:
         st.info(i("no_saved_charts"))
     else:
@@ -591,3 +789,59 @@ def saved_charts_ui():
             selection_mode="single-cell",
             on_select=lambda d=data: on_select(d),
         )
+        if pages > 1:
+            st.number_input(i("page"), min_value=1, max_value=pages, key="charts_page")
+        export_ui()
+
+
+def export_ui():
+    """ZIP of PDF reports of the saved charts matching the search, built in the background into a temporary file"""
+
+    def start():
+        if job := SESS.export_job:
+            job["file"].close()
+        job = {"done": 0, "total": 0, "file": TemporaryFile(), "filename": f"{i(SESS.chart_type)}.zip"}
+
+        def progress(done: int, total: int):
+            job["done"], job["total"] = done, total
+
+        job["future"] = submit_export(st.user.email, SESS.chart_type, SESS.charts_query, job["file"], progress)
+        SESS.export_job = job
+
+    def progress(job: dict):
+        if job["future"].done():
+            st.rerun()
+        text = i("export_progress").format(done=job["done"], total=job["total"])
+        st.progress(job["done"] / max(job["total"], 1), text=text)
+
+    def zip_bytes(fp) -> bytes:
+        """read when the download is clicked, so the page doesn't keep the ZIP in memory"""
+        fp.seek(0)
+        return fp.read()
+
+    job = SESS.export_job
+    running = job is not None and not job["future"].done()
+    st.button(
+        i("export_pdfs"),
+        icon=":material/folder_zip:",
+        key="export-pdfs",
+        width="stretch",
+        disabled=running,
+        on_click=start,
+    )
+    if running:
+        st.fragment(progress, run_every=PDF_POLL_INTERVAL)(job)
+    elif job and job["future"].exception():
+        st.toast(i("export_failed"), icon=":material/error:")
+        job["file"].close()
+        SESS.export_job = None
+    elif job:
+        st.download_button(
+            i("download_zip"),
+            icon=":material/download:",
+            data=lambda fp=job["file"]: zip_bytes(fp),
+            file_name=job["filename"],
+            mime="application/zip",
+            width="stretch",
+            on_click="ignore",
+        )
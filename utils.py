@@ -1,24 +1,63 @@
 import json
 import logging
 import pandas as pd
-import sqlite3
 import streamlit as st
-from const import DEFAULT_INPUTS, I18N, ORBS, SESS
+import threading
+import time
+from analysis import analysis_key, chart_analysis
+from cache import DiskCache, LRUCache
+from cities import CityIndex, load_cities
+from const import (
+    CHART_CACHE_SIZE,
+    CHART_CACHE_TTL,
+    DB_BATCH_SIZE,
+    DB_PATH,
+    DB_POOL_SIZE,
+    DEFAULT_INPUTS,
+    EVENTS_CACHE_SIZE,
+    EXACT_ASPECT_DAYS,
+    I18N,
+    ORBS,
+    PDF_CACHE_BYTES,
+    PDF_CACHE_DIR,
+    PDF_QUEUE_DEPTH,
+    PDF_TEMPLATE_VERSION,
+    PDF_WORKERS,
+    SAVED_CHARTS_CACHE_SIZE,
+    SAVED_CHARTS_PAGE_SIZE,
+    SESS,
+    SETTINGS_CACHE_SIZE,
+    STATS_HTML_CACHE_SIZE,
+    TIMELINE_CACHE_SIZE,
+    TIMELINE_PREWARM,
+    TIMELINE_STEPS,
+)
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
-from io import BytesIO
-from natal import Chart, Config, Data, Stats
+from db import Database
+from ephemeris import key_of, shared_data, solar_return_dt
+from functools import wraps
+from hashlib import md5
+from importlib.metadata import version
+from itertools import count
+from natal import Chart, Config, Data
 from natal.config import Display
 from natal.const import ASPECT_NAMES
+from natal.data import DotDict
 from pathlib import Path
+from pdf import PDF_CSS, PdfQueue
 from streamlit.components.v2 import component as custom_component
-from tagit import div, main, style, table, td, tr
-from typing import Iterable, Literal
-from weasyprint import HTML
-from weasyprint.text.fonts import FontConfiguration
+from streamlit.logger import get_logger
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from tagit import div, main
+from timeline import AspectEvent, Timeline, exact_aspects, shift
+from typing import Callable, Iterable, Iterator, Literal
 from zoneinfo import ZoneInfo
 
 # suppress fontTools warnings
 logging.getLogger("fontTools").setLevel(logging.ERROR)
+# fragment run times, shown with `streamlit run main.py --logger.level=debug`
+logger = get_logger(__name__)
 
 
 def lang_num() -> int:
@@ -49,143 +88,255 @@ def i(key: str) -> str:
     return I18N[key][lang_num()]
 
 
-def utc_of(id: int) -> datetime:
+def utc_of(id: int, sess: DotDict = SESS) -> datetime:
     """convert local datetime to utc datetime"""
-    naive_dt = get_dt(id)
-    tzinfo = ZoneInfo(SESS[f"tz{id}"])
+    naive_dt = get_dt(id, sess)
+    tzinfo = ZoneInfo(sess[f"tz{id}"])
     dt = naive_dt.replace(tzinfo=tzinfo)
     return dt.astimezone(ZoneInfo("UTC"))
 
 
-def get_dt(id: int) -> datetime:
+def get_dt(id: int, sess: DotDict = SESS) -> datetime:
     """get datetime from session state"""
-    date = SESS[f"date{id}"]
-    hr = SESS[f"hr{id}"]
-    minute = SESS[f"min{id}"]
+    date = sess[f"date{id}"]
+    hr = sess[f"hr{id}"]
+    minute = sess[f"min{id}"]
     return datetime(date.year, date.month, date.day, hr, minute)
 
 
-@st.cache_data
-def cities_df() -> pd.DataFrame:
-    return pd.read_csv("cities.csv")
+@st.cache_resource
+def data_db() -> Database:
+    return Database(DB_PATH, pool_size=DB_POOL_SIZE, batch_size=DB_BATCH_SIZE)
+
+
+@st.cache_resource
+def settings_cache() -> LRUCache:
+    return LRUCache("user_settings", max_entries=SETTINGS_CACHE_SIZE)
 
 
 @st.cache_resource
-def data_db() -> sqlite3.Connection:
-    return sqlite3.connect("data.db", check_same_thread=False)
+def city_index() -> CityIndex:
+    return load_cities()
 
 
-@st.cache_data
 def all_timezones() -> list[str]:
-    return cities_df()["tz"].unique()
+    return city_index().timezones
 
 
-def natal_data(id: int) -> Data:
+@st.cache_resource
+def svg_cache() -> LRUCache:
+    return LRUCache("chart_svg", max_entries=CHART_CACHE_SIZE, ttl=CHART_CACHE_TTL)
+
+
+def chart_svg(key: str, data1: Data, data2: Data | None, width: int) -> str:
+    """chart SVG, rendered once per process for the same chart key"""
+    return svg_cache().get_or_set(key, lambda: Chart(data1, width, data2=data2).svg)
+
+
+def natal_data(id: int, sess: DotDict = SESS) -> Data:
     """return natal data from a chart input ui"""
-    display = {key: SESS[f"{key}{id}"] for key in Display.model_fields}
-    aspects = {aspect: SESS[aspect] for aspect in ASPECT_NAMES}
-    hse_1st_char = SESS.house_sys[0]
-    data = Data(
-        name=SESS[f"name{id}"],
-        lat=SESS[f"lat{id}"],
-        lon=SESS[f"lon{id}"],
-        utc_dt=utc_of(id),
+    display = {key: sess[f"{key}{id}"] for key in Display.model_fields}
+    aspects = {aspect: sess[aspect] for aspect in ASPECT_NAMES}
+    hse_1st_char = sess.house_sys[0]
+    data = shared_data(
+        name=sess[f"name{id}"],
+        lat=sess[f"lat{id}"],
+        lon=sess[f"lon{id}"],
+        utc_dt=utc_of(id, sess),
         config=Config(house_sys=hse_1st_char, orb=aspects, display=display),
     )
-    is_solar_return = id == 1 and SESS.chart_type == "solar_return_page"
-    return data.solar_return(target_yr=SESS.solar_return_year) if is_solar_return else data
+    if id == 1 and sess.chart_type == "solar_return_page":
+        utc_dt = solar_return_dt(data, sess.solar_return_year)
+        return shared_data(name=data.name, lat=data.lat, lon=data.lon, utc_dt=utc_dt, config=data.config)
+    return data
 
 
 def step(chart_id: int, delta: Literal[1, -1]):
-    """step implementation for stepper ui"""
-    dt = get_dt(chart_id)
-    unit = SESS.stepper_unit
-    match unit:
-        case "week":
-            delta = timedelta(weeks=delta)
-        case "day":
-            delta = timedelta(days=delta)
-        case "hour":
-            delta = timedelta(hours=delta)
-        case "minute":
-            delta = timedelta(minutes=delta)
-        case "month":
-            new_month = dt.month + delta
-            new_year = dt.year + (new_month - 1) // 12
-            new_month = ((new_month - 1) % 12) + 1
-            dt = dt.replace(year=new_year, month=new_month)
-        case "year":
-            dt = dt.replace(year=dt.year + delta)
-
-    if unit not in ["month", "year"]:
-        dt += delta
-
+    """step implementation for stepper ui, transit steps move along the timeline"""
+    if chart_id == 2 and SESS.chart_type == "transit_page":
+        move_timeline(timeline_pos()["offset"] + delta)
+        return
+    dt = shift(get_dt(chart_id), SESS.stepper_unit, delta)
     SESS[f"date{chart_id}"] = dt.date()
     SESS[f"hr{chart_id}"] = dt.hour
     SESS[f"min{chart_id}"] = dt.minute
 
 
-def charts_df() -> pd.DataFrame | None:
-    def calculate_age(birth: str) -> str:
-        birth_dt = pd.to_datetime(birth).replace(tzinfo=timezone.utc)
-        today = pd.Timestamp.now(tz="UTC")
-        age = today.year - birth_dt.year
-        if (today.month, today.day) < (birth_dt.month, birth_dt.day):
-            age -= 1
-        return str(age)
-
-    sql = "select data, hash from charts where email = ? and chart_type = ? order by updated_at desc"
-    cursor = data_db().cursor()
-    cursor.execute(sql, (st.user.email, SESS.chart_type))
-    all_data = cursor.fetchall()
-    if not all_data:
-        return None
+def timeline_pos() -> dict:
+    """anchor, unit and step offset of the transit datetime, and the center step of its timeline batch
 
-    df = pd.DataFrame([{**json.loads(d), "hash": h} for (d, h) in all_data])
-    if len(df) == 0:
-        return None
+    kept while the transit datetime is reached by stepping or scrubbing in the same unit, so every step is shifted
+    from the same anchor and month ends don't drift (Jan 31, Feb 28, Mar 31). any other change re-anchors
+    """
+    pos, unit, dt = SESS.timeline_pos, SESS.stepper_unit, get_dt(2)
+    if not (pos and pos["unit"] == unit and shift(pos["anchor"], unit, pos["offset"]) == dt):
+        pos = SESS.timeline_pos = {"anchor": dt, "unit": unit, "offset": 0, "center": 0}
+    return pos
+
+
+def move_timeline(offset: int) -> None:
+    """set the transit datetime to a step of the timeline"""
+    pos = timeline_pos()
+    dt = shift(pos["anchor"], pos["unit"], offset)
+    SESS.timeline_pos = pos | {"offset": offset}
+    SESS.date2 = dt.date()
+    SESS.hr2 = dt.hour
+    SESS.min2 = dt.minute
+
+
+@st.cache_resource
+def timeline_cache() -> LRUCache:
+    return LRUCache("timeline", max_entries=TIMELINE_CACHE_SIZE)
+
+
+def transit_timeline(data1: Data, data2: Data) -> Timeline:
+    """batch of transit steps around the transit datetime, reused until a step leaves it"""
+    pos = timeline_pos()
+    if abs(pos["offset"] - pos["center"]) > TIMELINE_STEPS:
+        pos = SESS.timeline_pos = pos | {"center": pos["offset"]}
+    anchor, unit, center = pos["anchor"], pos["unit"], pos["center"]
+    transit_key = (data2.lat, data2.lon, data2.house_sys, tuple(data2.config.display.model_dump().items()))
+    key = (key_of(data1), transit_key, SESS.tz2, unit, anchor, center)
+    return timeline_cache().get_or_set(
+        key, lambda: Timeline.build(data1, data2, SESS.tz2, anchor, unit, TIMELINE_STEPS, center)
+    )
+
+
+def prewarm_timeline(timeline: Timeline, data1: Data, chart_key: Callable[[DotDict], str]) -> None:
+    """transit data and chart SVG of the TIMELINE_PREWARM steps on each side of the transit datetime, built in a
+    background thread, so stepping or scrubbing to them is a cache lookup
+
+    chart_key: cache key of the chart SVG for a session state, as in `chart_ui`
+    """
+    idx = timeline.index_of(get_dt(2))
+    nearest = sorted(range(len(timeline.local_dts)), key=lambda n: abs(n - idx))[1 : 2 * TIMELINE_PREWARM + 1]
+    state, width = SESS.to_dict(), SESS.chart_size
+    charts = []
+    for n in nearest:
+        dt = timeline.local_dts[n]
+        sess = DotDict(**(state | {"date2": dt.date(), "hr2": dt.hour, "min2": dt.minute}))
+        if (key := chart_key(sess)) not in svg_cache():
+            charts.append((key, sess))
+    if not charts:
+        return
+
+    def run():
+        try:
+            for key, sess in charts:
+                chart_svg(key, data1, natal_data(2, sess), width)
+        except Exception as e:  # only a cache miss later
+            logger.error("timeline prewarm failed: %r", e)
+
+    thread = threading.Thread(target=run, name="timeline_prewarm", daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
 
-    df.set_index("hash", inplace=True, drop=False)
-    df.rename(columns={"hash": "delete"}, inplace=True)
-    df["delete"] = "?delete=" + df["delete"] + "&chart_type=" + SESS.chart_type
-    df["age1"] = df["dt1"].apply(calculate_age)
-    df["age2"] = df["dt2"].apply(calculate_age)
-    df["solar_return_year"] = df["solar_return_year"].astype(str)
-    return df
+
+@st.cache_resource
+def events_cache() -> LRUCache:
+    return LRUCache("aspect_events", max_entries=EVENTS_CACHE_SIZE)
+
+
+def aspect_events(data1: Data, data2: Data) -> list[AspectEvent]:
+    """exact transit aspects for EXACT_ASPECT_DAYS from the start of the transit date"""
+    start = datetime.combine(SESS.date2, datetime.min.time(), tzinfo=ZoneInfo(SESS.tz2))
+    start = start.astimezone(timezone.utc)
+    end = start + timedelta(days=EXACT_ASPECT_DAYS)
+    key = (key_of(data1), tuple(data2.config.display.model_dump().items()), start)
+    return events_cache().get_or_set(key, lambda: exact_aspects(data1, data2, start, end))
+
+
+# a version per user, bumped by every save or delete, so cached pages of other users survive
+_chart_versions: dict[str, int] = {}
+_versions = count(1)
+
+
+def touch_charts(email: str) -> None:
+    """invalidate the cached saved charts of a user"""
+    _chart_versions[email] = next(_versions)
+
+
+def charts_version(email: str) -> int | None:
+    return _chart_versions.get(email)
+
+
+@st.cache_resource
+def saved_charts_cache() -> LRUCache:
+    return LRUCache("saved_charts", max_entries=SAVED_CHARTS_CACHE_SIZE)
+
+
+def charts_filter(email: str, chart_type: str, query: str) -> tuple[str, list]:
+    """WHERE clause and params of the saved charts matching a name or city"""
+    sql = "email = ? AND chart_type = ?"
+    params = [email, chart_type]
+    if query := query.strip():
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        sql += r" AND (name1 LIKE ? ESCAPE '\' OR name2 LIKE ? ESCAPE '\' OR json_extract(data, '$.city1') LIKE ? ESCAPE '\')"
+        params += [pattern] * 3
+    return sql, params
+
+
+def ages(dts: pd.Series) -> pd.Series:
+    """age in whole years today"""
+    dts = pd.to_datetime(dts)
+    today = pd.Timestamp.now(tz="UTC")
+    before_birthday = (dts.dt.month > today.month) | ((dts.dt.month == today.month) & (dts.dt.day > today.day))
+    return (today.year - dts.dt.year - before_birthday).astype(str)
+
+
+def charts_count(email: str, chart_type: str, query: str = "") -> int:
+    """number of saved charts matching the query"""
+    where, params = charts_filter(email, chart_type, query)
+    key = ("count", email, charts_version(email), chart_type, query)
+    return saved_charts_cache().get_or_set(
+        key, lambda: data_db().fetchone(f"SELECT count(*) FROM charts WHERE {where}", params)[0]
+    )
+
+
+def charts_df(email: str, chart_type: str, query: str = "", page: int = 1) -> pd.DataFrame | None:
+    """one page of saved charts matching the query, newest first"""
+
+    def load() -> pd.DataFrame | None:
+        where, params = charts_filter(email, chart_type, query)
+        sql = f"SELECT data, hash FROM charts WHERE {where} ORDER BY updated_at DESC LIMIT ? OFFSET ?"
+        rows = data_db().fetchall(sql, params + [SAVED_CHARTS_PAGE_SIZE, (page - 1) * SAVED_CHARTS_PAGE_SIZE])
+        if not rows:
+            return None
+
+        df = pd.DataFrame([{**json.loads(d), "hash": h} for (d, h) in rows])
+        df.set_index("hash", inplace=True, drop=False)
+        df.rename(columns={"hash": "delete"}, inplace=True)
+        df["delete"] = "?delete=" + df["delete"] + "&chart_type=" + chart_type
+        df["age1"] = ages(df["dt1"])
+        df["age2"] = ages(df["dt2"])
+        df["solar_return_year"] = df["solar_return_year"].astype(str)
+        return df
+
+    # ages change at midnight
+    key = ("page", email, charts_version(email), chart_type, query, page, datetime.now(timezone.utc).date())
+    return saved_charts_cache().get_or_set(key, load)
 
 
 @st.cache_data(ttl=60)
 def get_saved_natal_names(email: str | None) -> list[str]:
-    """Return unique name1 values from saved birth_page charts for the user."""
+    """Return unique name1 values from saved birth_page charts for the user, most recently saved first."""
     if not email:
         return []
-    sql = "SELECT data FROM charts WHERE email = ? AND chart_type = 'birth_page' ORDER BY updated_at DESC"
-    cursor = data_db().cursor()
-    cursor.execute(sql, (email,))
-    rows = cursor.fetchall()
-    seen: set[str] = set()
-    names: list[str] = []
-    for (row,) in rows:
-        data = json.loads(row)
-        name1 = data.get("name1") or ""
-        if name1 and name1 not in seen:
-            seen.add(name1)
-            names.append(name1)
-    return names
+    sql = """SELECT name1 FROM charts
+        WHERE email = ? AND chart_type = 'birth_page' AND name1 != ''
+        GROUP BY name1 ORDER BY max(updated_at) DESC"""
+    return [name for (name,) in data_db().fetchall(sql, (email,))]
 
 
 def get_chart_by_name(name: str, email: str) -> dict | None:
     """Return most recent birth_page chart data for the given name and user, or None."""
     if not name or not email:
         return None
-    sql = "SELECT data FROM charts WHERE email = ? AND chart_type = 'birth_page' ORDER BY updated_at DESC"
-    cursor = data_db().cursor()
-    cursor.execute(sql, (email,))
-    for (row,) in cursor.fetchall():
-        data = json.loads(row)
-        if data.get("name1") == name:
-            return data
-    return None
+    sql = """SELECT data FROM charts
+        WHERE email = ? AND chart_type = 'birth_page' AND name1 = ?
+        ORDER BY updated_at DESC LIMIT 1"""
+    row = data_db().fetchone(sql, (email, name))
+    return json.loads(row[0]) if row else None
 
 
 def reset_inputs() -> bool:
@@ -210,14 +361,14 @@ def update_orbs() -> bool:
     return True
 
 
-def is_form_valid(num: int) -> bool:
+def is_form_valid(num: int, sess: DotDict = SESS) -> bool:
     for name in ["name", "tz", "date"]:
         key = f"{name}{num}"
-        if not SESS.get(key):
+        if not sess.get(key):
             return False
     for name in ["lat", "lon"]:
         key = f"{name}{num}"
-        if SESS.get(key) is None:
+        if sess.get(key) is None:
             return False
     return True
 
@@ -225,113 +376,149 @@ def is_form_valid(num: int) -> bool:
 # stats and pdf report =========================================================
 
 
-def html_table(grid: list[Iterable]) -> str:
-    """converts list of iterable into an HTML table"""
-    rows = []
+def table_parts(grid: list[Iterable]) -> Iterator[str]:
+    """an HTML table piece by piece, joined once by the caller"""
+    yield "<table>"
     for row in grid:
-        cells = []
+        yield "<tr>"
         for cell in row:
             if isinstance(cell, str) and cell.startswith("null:"):
-                cells.append(td(cell.split(":")[1], colspan=2))
+                yield '<td colspan="2">'
+                yield cell.split(":")[1]
             else:
-                cells.append(td(cell))
-        rows.append(tr(cells))
-    return table(rows)
+                yield "<td>"
+                yield "" if cell is None else str(cell)
+            yield "</td>"
+        yield "</tr>"
+    yield "</table>"
 
 
-def html_section(title: str, grid: list[Iterable], class_: str = "") -> str:
-    """creates an HTML section with a title and data table"""
-    return div(
-        div(title, class_="title") + html_table(grid),
-        class_="section " + class_,
-    )
+def html_table(grid: list[Iterable]) -> str:
+    """converts list of iterable into an HTML table"""
+    return "".join(table_parts(grid))
 
 
-def pdf_io(html: str) -> BytesIO:
-    """PDF generation from HTML string"""
-    fp = BytesIO()
-    font_config = FontConfiguration()
-    HTML(string=html).write_pdf(fp, font_config=font_config)
-    return fp
+def html_section(title: str, grid: list[Iterable], class_: str = "") -> str:
+    """creates an HTML section with a title and data table"""
+    head = f'<div class="section {class_}"><div class="title">{title}</div>'
+    return "".join([head, *table_parts(grid), "</div>"])
 
 
-def local_time_label() -> str:
-    match SESS.chart_type:
-        case "birth_page" | "synastry_page":
-            return i("birth_time")
-        case "transit_page":
-            return i("local_time")
-        case "solar_return_page":
-            return i("solar_return_time")
+@st.cache_resource
+def pdf_queue() -> PdfQueue:
+    return PdfQueue(workers=PDF_WORKERS, max_jobs=PDF_QUEUE_DEPTH)
 
 
-def stats_html(data1: Data, data2: Data = None):
-    stats = Stats(data1=data1, data2=data2, city1=SESS.city1, city2=SESS.city2, tz1=SESS.tz1, tz2=SESS.tz2)
-    basic_info_headers = [i("name"), i("city"), i("coordinates"), local_time_label()]
-    basic_info_title = f"{i(SESS.chart_type)} - {i('basic_info')}"
-    basic_info = html_section(basic_info_title, stats.basic_info(basic_info_headers))
+@st.cache_resource
+def pdf_cache() -> DiskCache:
+    return DiskCache("pdf", PDF_CACHE_DIR, max_bytes=PDF_CACHE_BYTES)
 
-    ele_mod_headers = [i("fire"), i("air"), i("water"), i("earth"), i("sum")]
-    ele_mod_row = [i("cardinal"), i("fixed"), i("mutable"), i("sum")]
-    ele_mod_polor = [i("polarity"), i("pos"), i("neg")]
-    ele_mod_grid = stats.elements_vs_modalities(ele_mod_headers, ele_mod_row, ele_mod_polor)
-    ele_mod = html_section(i("elements_vs_modalities"), ele_mod_grid)
 
-    quad_hemi_headers = [i("eastern"), i("western"), i("northern"), i("southern"), i("sum")]
-    quad_hemi_grid = stats.quadrants_vs_hemispheres(quad_hemi_headers)
-    quad_hemi = html_section(i("quad_vs_hemi"), quad_hemi_grid)
+# part of the PDF cache keys, a deploy changing the stylesheet, report template or natal renders new PDFs
+PDF_VERSION = (PDF_TEMPLATE_VERSION, md5(PDF_CSS.read_bytes()).hexdigest(), version("natal"))
 
-    body_headers = [i("body"), i("sign"), i("house"), i("dignity")]
-    dignity_labels = [i("domicile"), i("exaltation"), i("fall"), i("detriment")]
-    bodies_grid = stats.celestial_bodies(1, body_headers, dignity_labels)
-    user_name = f" - {data1.name}" if data2 else ""
-    bodies = html_section(i("celestial_body") + user_name, bodies_grid)
-    houses_title = f"{i('houses')} - {i(SESS.house_sys)}"
 
-    if data2:
-        # bodies 2
-        bodies_grid2 = stats.celestial_bodies(2, body_headers, dignity_labels)
-        bodies2 = html_section(i("celestial_body") + f" - {data2.name}", bodies_grid2)
-        bodies += bodies2
-        # sign distribution 1 & 2
-        synastry_sign_headers = [i("sign"), data1.name, data2.name, i("sum")]
-        synastry_signs_grid = stats.signs(headers=synastry_sign_headers)
-        signs = html_section(i("signs"), synastry_signs_grid)
-        # house distribution
-        synastry_houses_headers = [i("house"), i("cusp"), data1.name, data2.name, i("sum")]
-        synastry_houses_grid = stats.houses(headers=synastry_houses_headers)
-        houses = html_section(houses_title, synastry_houses_grid)
-        # cross ref
-        aspects_title = f"{i('aspects')} - {data1.name}: {i('rows')} / {data2.name}: {i('cols')}"
-    else:
-        # sign distribution 1
-        sign_headers = [i("sign"), i("bodies"), i("sum")]
-        signs_grid = stats.signs(headers=sign_headers)
-        signs = html_section(i("signs"), signs_grid)
-        # house distribution 1
-        houses_headers = [i("house"), i("cusp"), i("bodies"), i("sum")]
-        houses_grid = stats.houses(headers=houses_headers)
-        houses = html_section(houses_title, houses_grid)
-        aspects_title = i("aspects")
+def pdf_filename(sess: DotDict = SESS) -> str:
+    name_parts = [sess.name1]
+    if sess.name2 and sess.chart_type == "synastry_page":
+        name_parts.append(sess.name2)
+    name_parts.append(i(sess.chart_type))
+    return "_".join(name_parts)
 
-    aspect_grid = stats.aspect_grid(total_label=i("sum"))
-    aspect_cls = "" if data2 else "aspect_grid"
-    aspects = html_section(aspects_title, aspect_grid, class_=aspect_cls)
 
-    html = basic_info + ele_mod + quad_hemi + bodies + signs + houses + aspects
-    return html
+def local_time_label(sess: DotDict = SESS) -> str:
+    match sess.chart_type:
+        case "birth_page" | "synastry_page":
+            return i("birth_time")
+        case "transit_page":
+            return i("local_time")
+        case "solar_return_page":
+            return i("solar_return_time")
 
 
-def pdf_html(data1: Data, data2: Data = None):
+@st.cache_resource
+def stats_html_cache() -> LRUCache:
+    return LRUCache("stats_html", max_entries=STATS_HTML_CACHE_SIZE)
+
+
+def stats_html(data1: Data, data2: Data = None, sess: DotDict = SESS) -> str:
+    """statistics panel, each section rendered once per chart, language and section"""
+    stats = chart_analysis(data1, data2, sess)
+
+    def basic_info() -> str:
+        headers = [i("name"), i("city"), i("coordinates"), local_time_label(sess)]
+        title = f"{i(sess.chart_type)} - {i('basic_info')}"
+        return html_section(title, stats.basic_info(headers))
+
+    def elements_vs_modalities() -> str:
+        headers = [i("fire"), i("air"), i("water"), i("earth"), i("sum")]
+        row_label = [i("cardinal"), i("fixed"), i("mutable"), i("sum")]
+        polarity_label = [i("polarity"), i("pos"), i("neg")]
+        grid = stats.elements_vs_modalities(headers, row_label, polarity_label)
+        return html_section(i("elements_vs_modalities"), grid)
+
+    def quadrants_vs_hemispheres() -> str:
+        headers = [i("eastern"), i("western"), i("northern"), i("southern"), i("sum")]
+        return html_section(i("quad_vs_hemi"), stats.quadrants_vs_hemispheres(headers))
+
+    def celestial_bodies() -> str:
+        headers = [i("body"), i("sign"), i("house"), i("dignity")]
+        dignity_labels = [i("domicile"), i("exaltation"), i("fall"), i("detriment")]
+        user_name = f" - {data1.name}" if data2 else ""
+        html = html_section(i("celestial_body") + user_name, stats.celestial_bodies(1, headers, dignity_labels))
+        if data2:
+            grid2 = stats.celestial_bodies(2, headers, dignity_labels)
+            html += html_section(i("celestial_body") + f" - {data2.name}", grid2)
+        return html
+
+    def signs() -> str:
+        if data2:
+            headers = [i("sign"), data1.name, data2.name, i("sum")]
+        else:
+            headers = [i("sign"), i("bodies"), i("sum")]
+        return html_section(i("signs"), stats.signs(headers=headers))
+
+    def houses() -> str:
+        if data2:
+            headers = [i("house"), i("cusp"), data1.name, data2.name, i("sum")]
+        else:
+            headers = [i("house"), i("cusp"), i("bodies"), i("sum")]
+        return html_section(f"{i('houses')} - {i(sess.house_sys)}", stats.houses(headers=headers))
+
+    def aspects() -> str:
+        if data2:
+            title = f"{i('aspects')} - {data1.name}: {i('rows')} / {data2.name}: {i('cols')}"
+        else:
+            title = i("aspects")
+        grid = stats.aspect_grid(total_label=i("sum"))
+        return html_section(title, grid, class_="" if data2 else "aspect_grid")
+
+    sections: list[tuple[tuple, Callable[[], str]]] = [
+        # basic info also shows the chart type and its local time label
+        (("basic_info", sess.chart_type), basic_info),
+        (("elements_vs_modalities",), elements_vs_modalities),
+        (("quadrants_vs_hemispheres",), quadrants_vs_hemispheres),
+        (("celestial_bodies",), celestial_bodies),
+        (("signs",), signs),
+        # title names the house system, its data key only has the first letter
+        (("houses", sess.house_sys), houses),
+        (("aspects",), aspects),
+    ]
+    chart, lang = analysis_key(data1, data2, sess), lang_num()
+    cache = stats_html_cache()
+    return "".join(cache.get_or_set((chart, lang, *section), build) for section, build in sections)
+
+
+def pdf_html(data1: Data, data2: Data = None, sess: DotDict = SESS):
     """html source for PDF report"""
-    data1.config.theme_type = SESS.pdf_color
+    data1.config.theme_type = sess.pdf_color
     data1.config.chart.stroke_width = 0.7
 
-    stats = Stats(data1=data1, data2=data2, city1=SESS.city1, city2=SESS.city2, tz1=SESS.tz1, tz2=SESS.tz2)
+    stats = chart_analysis(data1, data2, sess)
     chart = Chart(data1, width=400, data2=data2)
 
-    basic_info_title = f"{i(SESS.chart_type)} - {i('basic_info')}"
-    basic_info_headers = [i("name"), i("city"), i("coordinates"), local_time_label()]
+    basic_info_title = f"{i(sess.chart_type)} - {i('basic_info')}"
+    basic_info_headers = [i("name"), i("city"), i("coordinates"), local_time_label(sess)]
     ele_vs_mod_headers = ["🜂", "🜁", "🜄", "🜃", "∑"]
     ele_vs_mod_row_label = ["⟑", "⊟", "𛰣", "∑"]
     ele_vs_mod_polarity_label = ["◐", "+", "-"]
@@ -341,7 +528,7 @@ def pdf_html(data1: Data, data2: Data = None):
     aspects_title = i("aspects")
     signs_title = i("signs")
     signs_headers = [i("sign")]
-    houses_title = f"{i('houses')} - {i(SESS.house_sys)}"
+    houses_title = f"{i('houses')} - {i(sess.house_sys)}"
     if data2:
         ele_vs_mod_title = i("elements_vs_modalities") + f" - {data1.name}"
         quad_vs_hemi_title = i("quad_vs_hemi") + f" - {data1.name}"
@@ -395,12 +582,52 @@ def pdf_html(data1: Data, data2: Data = None):
         + html_section(houses_title, stats.houses(headers=houses_headers, pdf=True))
         + html_section(orb_title, stats.orb_settings(headers=orb_headers))
     )
-    css = Path(__file__).parent.joinpath("pdf.css").read_text()
     rows = div(row1, class_="row1") + div(row2, class_="row2") + div(row3, class_="row3")
-    html = style(css) + main(rows)
+    # styled by the renderer's precompiled pdf.css
+    html = main(rows)
     return html
 
 
+# fragments ====================================================================
+
+
+def fragment_run() -> bool:
+    """whether this script run reruns fragments only, rather than the whole app"""
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """log how long a part of the page took, and whether it ran with the app or as a fragment rerun"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        scope = "fragment" if fragment_run() else "app"
+        logger.debug("%s %s run: %.1f ms", name, scope, (time.perf_counter() - start) * 1e3)
+
+
+def timed_fragment(name: str) -> Callable[[Callable], Callable]:
+    """st.fragment with its run times logged"""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def run(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+
+        return st.fragment(run)
+
+    return decorator
+
+
+def rerun_app_if_changed(key: str, state: object) -> None:
+    """rerun the whole app if a fragment rerun changed state that another fragment recorded in SESS[key]"""
+    if fragment_run() and SESS.get(key) != state:
+        st.rerun()
+
+
 # custom components ============================================================
 
 scroll_to_bottom = custom_component(